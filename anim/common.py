@@ -34,6 +34,12 @@ where the latter can contain any mixture of constant values and interpolators.
 The resultant draw procedure will invoke the specified sequence of drawing
 calls, automatically applying any interpolators to the current animation
 time to determine the corresponding argument values for that time.
+
+Most of the interpolators and draw procedures created by this module also
+describe which other interpolators, draw procedures and values they depend on
+over which time intervals. This allows time_changes to compare two versions of
+an animation and work out which times could look different between them, so
+that render_anim can re-render just the affected frames after an edit.
 """
 #+
 # Copyright 2014-2016 by Lawrence D'Oliveiro <ldo@geek-central.gen.nz>.
@@ -46,6 +52,10 @@ import sys
 import os
 import math
 import time
+import ctypes as ct
+import collections
+import threading
+import concurrent.futures
 import qahirah as qah
 
 #+
@@ -67,7 +77,11 @@ def is_interpolator(f) :
 def constant_interpolator(y) :
     "returns a function of x that always returns the same constant value y."
     return \
-        interpolator(lambda x : y)
+        depends_on \
+          (
+            interpolator(lambda x : y),
+            lambda : ((- math.inf, math.inf, IDENTITY_TIME, y),)
+          )
 #end constant_interpolator
 
 def ensure_interpolator(f) :
@@ -87,7 +101,11 @@ def linear_interpolator(from_x, to_x, from_y, to_y) :
     "returns a function of x in the range [from_x .. to_x] which returns" \
     " the corresponding linearly-interpolated value in the range [from_y .. to_y]."
     return \
-        interpolator(lambda x : (x - from_x) / (to_x - from_x) * (to_y - from_y) + from_y)
+        depends_on \
+          (
+            interpolator(lambda x : (x - from_x) / (to_x - from_x) * (to_y - from_y) + from_y),
+            lambda : ((- math.inf, math.inf, IDENTITY_TIME, (from_x, to_x, from_y, to_y)),)
+          )
 #end linear_interpolator
 
 def ease_inout_interpolator(x0, x1, x2, x3, from_y, to_y) :
@@ -118,7 +136,11 @@ def ease_inout_interpolator(x0, x1, x2, x3, from_y, to_y) :
     #end ease_inout
 
     return \
-        ease_inout
+        depends_on \
+          (
+            ease_inout,
+            lambda : ((- math.inf, math.inf, IDENTITY_TIME, (x0, x1, x2, x3, from_y, to_y)),)
+          )
 #end ease_inout_interpolator
 
 def piecewise_interpolator(x_vals, interps) :
@@ -145,11 +167,32 @@ def piecewise_interpolator(x_vals, interps) :
         return y
     #end interpolate
 
+    def dependencies() :
+        # each segment depends on its own interpolator over its part of the
+        # domain, and on the accumulated y_offset from the preceding segments.
+        result = []
+        y_offset = 0
+        for i in range(len(interps)) :
+            from_x = (x_vals[i], - math.inf)[i == 0]
+            to_x = (x_vals[i + 1], math.inf)[i == len(interps) - 1]
+            result.append \
+              (
+                (from_x, to_x, ("linear", x_vals[i + 1] - x_vals[i], x_vals[i]), interps[i])
+              )
+            result.append((from_x, to_x, IDENTITY_TIME, y_offset))
+            if i < len(interps) - 1 :
+                y_offset += interps[i](1) - interps[i + 1](0)
+            #end if
+        #end for
+        return \
+            result
+    #end dependencies
+
 #begin piecewise_interpolator
     assert len(x_vals) >= 2 and len(interps) + 1 == len(x_vals)
     interps = tuple(ensure_interpolator(f) for f in interps)
     return \
-        interpolate
+        depends_on(interpolate, dependencies)
 #end piecewise_interpolator
 
 def piecewise_sequential_interpolator(items, duration, offset) :
@@ -197,9 +240,13 @@ def periodic_interpolator(from_x, to_x, interp, offset = 0) :
     " an interpolator which repeats the same function over equal-sized intervals" \
     " before and after the original domain."
     return \
-        interpolator \
+        depends_on \
           (
-            lambda x : interp((x - offset) % (to_x - from_x) + from_x)
+            interpolator \
+              (
+                lambda x : interp((x - offset) % (to_x - from_x) + from_x)
+              ),
+            lambda : ((- math.inf, math.inf, ("periodic", from_x, to_x, offset), interp),)
           )
 #end periodic_interpolator
 
@@ -218,17 +265,35 @@ def step_interpolator(x_vals, y_vals) :
             y_vals[i]
     #end step_interpolate
 
+    def dependencies() :
+        return \
+            tuple \
+              (
+                (
+                    (x_vals[i], - math.inf)[i == 0],
+                    (x_vals[i + 1], math.inf)[i == len(y_vals) - 1],
+                    IDENTITY_TIME,
+                    y_vals[i],
+                )
+                for i in range(len(y_vals))
+              )
+    #end dependencies
+
 #begin step_interpolator
     assert len(x_vals) >= 2 and len(x_vals) == len(y_vals) + 1
     return \
-        step_interpolate
+        depends_on(step_interpolate, dependencies)
 #end step_interpolator
 
 def transform_interpolator(interp, scale = 1, offset = 0) :
     "returns an interpolator which is interp operating on an x-coordinate subjected" \
     " to the specified scale and offset."
     return \
-        interpolator(lambda x : interp((x - offset) / scale))
+        depends_on \
+          (
+            interpolator(lambda x : interp((x - offset) / scale)),
+            lambda : ((- math.inf, math.inf, ("linear", scale, offset), interp),)
+          )
 #end transform_interpolator
 
 def matrix_interpolator(*args) :
@@ -402,6 +467,16 @@ def make_draw(*draw_settings) :
         #end for
     #end apply_settings
 
+    def dependencies() :
+        result = []
+        for method, interp in draw_settings :
+            result.append((- math.inf, math.inf, IDENTITY_TIME, method))
+            result.append((- math.inf, math.inf, IDENTITY_TIME, interp))
+        #end for
+        return \
+            result
+    #end dependencies
+
 #begin make_draw
     if (
             len(draw_settings) == 1
@@ -417,7 +492,7 @@ def make_draw(*draw_settings) :
         draw_settings = draw_settings[0]
     #end if
     return \
-        apply_settings
+        depends_on(apply_settings, dependencies)
 #end make_draw
 
 def draw_overlay(*draw_procs) :
@@ -437,7 +512,11 @@ def draw_overlay(*draw_procs) :
         draw_procs = draw_procs[0]
     #end if
     return \
-        apply_overlay
+        depends_on \
+          (
+            apply_overlay,
+            lambda : tuple((- math.inf, math.inf, IDENTITY_TIME, proc) for proc in draw_procs)
+          )
 #end draw_overlay
 
 def draw_compose(*draw_procs) :
@@ -456,7 +535,11 @@ def draw_compose(*draw_procs) :
         draw_procs = draw_procs[0]
     #end if
     return \
-        apply_compose
+        depends_on \
+          (
+            apply_compose,
+            lambda : tuple((- math.inf, math.inf, IDENTITY_TIME, proc) for proc in draw_procs)
+          )
 #end draw_compose
 
 def draw_sequence(x_vals, draws) :
@@ -483,10 +566,20 @@ def draw_sequence(x_vals, draws) :
         draw(g, x)
     #end select_from_sequence
 
+    def dependencies() :
+        bounds = (- math.inf,) + tuple(x_vals) + (math.inf,)
+        return \
+            tuple \
+              (
+                (bounds[i], bounds[i + 1], IDENTITY_TIME, draws[i])
+                for i in range(len(draws))
+              )
+    #end dependencies
+
 #begin draw_sequence
     assert len(draws) != 0 and len(x_vals) + 1 == len(draws)
     return \
-        select_from_sequence
+        depends_on(select_from_sequence, dependencies)
 #end draw_sequence
 
 def draw_sequential(items, before, after, duration, offset) :
@@ -525,21 +618,217 @@ def retime_draw(draw, interp) :
         draw(g, interp(x))
     #end apply_draw
     return \
-        apply_draw
+        depends_on \
+          (
+            apply_draw,
+            lambda :
+                (
+                    (- math.inf, math.inf, IDENTITY_TIME, interp),
+                    (- math.inf, math.inf, OPAQUE_TIME, draw),
+                )
+          )
 #end retime_draw
 
 def transform_draw(draw, scale, offset) :
     "returns a draw procedure which is draw operating on an x-coordinate subjected" \
     " to the specified scale and offset."
     return \
-        retime_draw(draw, lambda x : (x - offset) / scale)
+        depends_on \
+          (
+            retime_draw(draw, lambda x : (x - offset) / scale),
+            lambda : ((- math.inf, math.inf, ("linear", scale, offset), draw),)
+          )
 #end transform_draw
 
+#+
+# Time dependencies
+#-
+
+IDENTITY_TIME = ("linear", 1, 0)
+OPAQUE_TIME = ("opaque",)
+
+def depends_on(f, dependencies) :
+    "attaches a description of its time dependencies to the interpolator or draw" \
+    " procedure f, for use by time_changes, and returns f. dependencies is a function" \
+    " of no arguments, returning a sequence of (from_x, to_x, mapping, dependent)" \
+    " tuples, each indicating that the results of f for times in [from_x, to_x]" \
+    " may depend on dependent, which can be another interpolator or draw procedure," \
+    " or a constant value, or a tuple or list of these. mapping indicates how the" \
+    " time passed to f relates to the time at which dependent is evaluated:\n" \
+    "    (“linear”, scale, offset) -- dependent is evaluated at (x - offset) / scale\n" \
+    "    (“periodic”, from_x, to_x, offset) -- as for periodic_interpolator\n" \
+    "    (“opaque”,) -- any other relationship\n" \
+    "Intervals can overlap, if f depends on more than one thing at the same time."
+    f.time_dependencies = dependencies
+    return \
+        f
+#end depends_on
+
+def merge_intervals(intervals) :
+    "returns a sorted list of disjoint (from_x, to_x) intervals covering the same" \
+    " times as the given sequence of (from_x, to_x) intervals."
+    result = []
+    for from_x, to_x in sorted(intervals) :
+        if len(result) != 0 and from_x <= result[-1][1] :
+            result[-1] = (result[-1][0], max(result[-1][1], to_x))
+        else :
+            result.append((from_x, to_x))
+        #end if
+    #end for
+    return \
+        result
+#end merge_intervals
+
+def map_time_interval(mapping, from_x, to_x, bound_from_x, bound_to_x) :
+    "given an interval [from_x, to_x] of times at which a dependent is evaluated," \
+    " returns a list of the corresponding intervals of outer times according to the" \
+    " given mapping (as described for depends_on), within [bound_from_x, bound_to_x]."
+    kind = mapping[0]
+    if kind == "linear" :
+        scale, offset = mapping[1:]
+        ends = sorted((from_x * scale + offset, to_x * scale + offset))
+        result = [tuple(ends)]
+    elif kind == "periodic" :
+        period_from_x, period_to_x, offset = mapping[1:]
+        from_x = max(from_x, period_from_x)
+        to_x = min(to_x, period_to_x)
+        period = period_to_x - period_from_x
+        if from_x > to_x :
+            result = []
+        elif math.isinf(bound_from_x) or math.isinf(bound_to_x) :
+            result = [(- math.inf, math.inf)]
+        else :
+            delta = offset - period_from_x
+            result = list \
+              (
+                (from_x + delta + i * period, to_x + delta + i * period)
+                for i in range
+                  (
+                    math.floor((bound_from_x - to_x - delta) / period),
+                    math.ceil((bound_to_x - from_x - delta) / period) + 1
+                  )
+              )
+        #end if
+    else :
+        result = [(- math.inf, math.inf)]
+    #end if
+    return \
+        result
+#end map_time_interval
+
+def time_changes(old, new, from_x = - math.inf, to_x = math.inf) :
+    "old and new are two versions of an interpolator or draw procedure, or of a" \
+    " constant value, or of a tuple or list of these. Returns a sorted list of" \
+    " disjoint (from_x, to_x) time intervals, within the given overall bounds," \
+    " outside of which old and new are guaranteed to produce the same results." \
+    " This is worked out from the time_dependencies attached to the interpolators" \
+    " and draw procedures by depends_on; where this information is not available," \
+    " any difference is assumed to apply at all times. The same applies if old and" \
+    " new are different kinds of interpolator or draw procedure (as determined by" \
+    " their code objects)."
+    changes = []
+    if old is new :
+        pass
+    elif not callable(old) and not callable(new) :
+        if type(old) in (tuple, list) and type(new) == type(old) and len(old) == len(new) :
+            for old_item, new_item in zip(old, new) :
+                changes.extend(time_changes(old_item, new_item, from_x, to_x))
+            #end for
+        elif old != new :
+            changes.append((from_x, to_x))
+        #end if
+    elif \
+        (
+            hasattr(old, "time_dependencies")
+        and
+            hasattr(new, "time_dependencies")
+        and
+            getattr(old, "__code__", type(old)) is getattr(new, "__code__", type(new))
+              # only comparable if made by the same kind of combinator
+        ) \
+    :
+        old_deps = tuple(old.time_dependencies())
+        new_deps = tuple(new.time_dependencies())
+        for i in range(max(len(old_deps), len(new_deps))) :
+            if i < len(old_deps) and i < len(new_deps) :
+                old_from_x, old_to_x, old_mapping, old_dependent = old_deps[i]
+                new_from_x, new_to_x, new_mapping, new_dependent = new_deps[i]
+                if (old_from_x, old_to_x, old_mapping) == (new_from_x, new_to_x, new_mapping) :
+                    for inner_from_x, inner_to_x in time_changes(old_dependent, new_dependent) :
+                        changes.extend \
+                          (
+                            (max(changed_from_x, old_from_x), min(changed_to_x, old_to_x))
+                            for changed_from_x, changed_to_x in map_time_interval
+                              (
+                                old_mapping,
+                                inner_from_x,
+                                inner_to_x,
+                                max(from_x, old_from_x),
+                                min(to_x, old_to_x)
+                              )
+                          )
+                    #end for
+                else :
+                    changes.append((min(old_from_x, new_from_x), max(old_to_x, new_to_x)))
+                #end if
+            else :
+                changed_from_x, changed_to_x = (old_deps, new_deps)[i >= len(old_deps)][i][:2]
+                changes.append((changed_from_x, changed_to_x))
+            #end if
+        #end for
+    else :
+        changes.append((from_x, to_x))
+    #end if
+    return \
+        merge_intervals \
+          (
+            (max(changed_from_x, from_x), min(changed_to_x, to_x))
+            for changed_from_x, changed_to_x in changes
+            if changed_from_x <= to_x and changed_to_x >= from_x
+          )
+#end time_changes
+
 #+
 # Higher-level useful stuff
 #-
 
-def draw_curve(g, f, closed, nr_steps, start = 0, end = 1) :
+def symmetric_curve_func(f, sector_steps, order, angle, period = None) :
+    "f is a function over integer steps returning (a value compatible with)" \
+    " a qahirah.Vector, which is known to have order-fold rotational symmetry" \
+    " about the origin: within each run of period steps (default sector_steps * order)," \
+    " the point at step n + sector_steps is the point at step n rotated by angle." \
+    " Returns an equivalent function which only invokes f for steps in the first" \
+    " sector of each period, obtaining the remaining points by rotating those."
+
+    def apply_symmetric(n) :
+        base, offset = divmod(n, period)
+        sector, offset = divmod(offset, sector_steps)
+        n0 = base * period + offset
+        point = sector_points.get(n0)
+        if point == None :
+            point = qah.Vector.from_tuple(f(n0))
+            sector_points[n0] = point
+        #end if
+        if sector != 0 :
+            cos, sin = rotations[sector]
+            point = qah.Vector(point.x * cos - point.y * sin, point.x * sin + point.y * cos)
+        #end if
+        return \
+            point
+    #end apply_symmetric
+
+#begin symmetric_curve_func
+    if period == None :
+        period = sector_steps * order
+    #end if
+    assert sector_steps * order == period
+    rotations = tuple((math.cos(i * angle), math.sin(i * angle)) for i in range(order))
+    sector_points = {}
+    return \
+        apply_symmetric
+#end symmetric_curve_func
+
+def draw_curve(g, f, closed, nr_steps, start = 0, end = 1, symmetry = None) :
     "g is a qahirah.Context, f is a function over [0, 1) returning" \
     " (a value compatible with) a qahirah.Vector of (x, y) coordinates," \
     " defining the curve to draw, and nr_steps is the number of straight-" \
@@ -548,7 +837,26 @@ def draw_curve(g, f, closed, nr_steps, start = 0, end = 1) :
     " draw; if omitted, they default to the entire curve. end can be less" \
     " than start, to wrap around the curve. If closed, then the end and start" \
     " points will be joined by an additional segment. The path will be" \
-    " stroked with the current settings in g."
+    " stroked with the current settings in g.\n" \
+    "\n" \
+    "symmetry is an optional (order, angle) tuple, indicating that f(x + 1 / order)" \
+    " is f(x) rotated about the origin by angle. In this case, f is only evaluated" \
+    " over one sector of the curve, the rest being obtained by rotation. The order" \
+    " is reduced as necessary so that each sector covers a whole number of steps."
+    step_point = lambda i : f(i / nr_steps)
+    if symmetry != None :
+        order, angle = symmetry
+        sector_order = math.gcd(order, nr_steps)
+        if sector_order > 1 :
+            step_point = symmetric_curve_func \
+              (
+                f = step_point,
+                sector_steps = nr_steps // sector_order,
+                order = sector_order,
+                angle = angle * order / sector_order
+              )
+        #end if
+    #end if
     g.new_path()
     if end < start :
         end += 1
@@ -556,7 +864,7 @@ def draw_curve(g, f, closed, nr_steps, start = 0, end = 1) :
     start_step = round(start * nr_steps)
     end_step = round(end * nr_steps)
     for i in range(start_step, end_step) :
-        g.line_to(f((i % nr_steps) / nr_steps))
+        g.line_to(step_point(i % nr_steps))
     #end for
     if closed and start_step % nr_steps == end_step % nr_steps :
         g.close_path()
@@ -564,7 +872,7 @@ def draw_curve(g, f, closed, nr_steps, start = 0, end = 1) :
     g.stroke()
 #end draw_curve
 
-def draw_curve_discrete(g, f, closed, nr_steps, start = 0, end = 1, subcurve = lambda n : 0) :
+def draw_curve_discrete(g, f, closed, nr_steps, start = 0, end = 1, subcurve = None) :
     "g is a qahirah.Context, f is a function over [0, nr_steps) returning" \
     " (a value compatible with) a qahirah.Vector of (x, y) coordinates," \
     " defining the curve to draw, and nr_steps is the number of discrete steps" \
@@ -572,33 +880,74 @@ def draw_curve_discrete(g, f, closed, nr_steps, start = 0, end = 1, subcurve = l
     " in [0, 1], of the actual part of the curve to draw; if omitted," \
     " they default to the entire curve. end can be less than start, to wrap" \
     " around the curve. If closed, then the end and start points will be" \
-    " joined by an additional segment. subcurve is an optional function that divides" \
-    " the curve into subcurves; every time it returns a different (integer) value," \
-    " a new subcurve is started.\n" \
+    " joined by an additional segment. subcurve optionally divides the curve into" \
+    " subcurves: it can be an integer stride, in which case a new subcurve starts" \
+    " every subcurve steps; or a sequence of the step indices at which each subcurve" \
+    " starts; or a function of the step index, in which case a new subcurve is started" \
+    " every time it returns a different (integer) value. The first two forms are" \
+    " cheaper, since they avoid a call per step.\n" \
     "\n" \
     "The path will be stroked with the current settings in g."
+
+    def break_subcurve() :
+        if closed :
+            g.close_path()
+        #end if
+        g.new_sub_path()
+    #end break_subcurve
+
+#begin draw_curve_discrete
     g.new_path()
     if end < start :
         end += 1
     #end if
     n_start = round(start * nr_steps)
     n_end = round(end * nr_steps)
-    last_subcurve = None
-    for i in range(n_start, n_end) :
-        this_subcurve = subcurve(i % nr_steps)
-        if this_subcurve != last_subcurve :
-            if last_subcurve != None :
-                if closed :
-                    g.close_path()
+    if nr_steps != 0 and n_end > n_start :
+        if callable(subcurve) :
+            last_subcurve = None
+            for i in range(n_start, n_end) :
+                this_subcurve = subcurve(i % nr_steps)
+                if this_subcurve != last_subcurve :
+                    if last_subcurve != None :
+                        break_subcurve()
+                    #end if
+                    last_subcurve = this_subcurve
                 #end if
-                g.new_sub_path()
+                g.line_to(f(i % nr_steps))
+            #end for
+        else :
+            if subcurve == None :
+                boundaries = ()
+            elif isinstance(subcurve, int) :
+                boundaries = range(0, nr_steps, subcurve)
+            else :
+                boundaries = sorted(set(i % nr_steps for i in subcurve))
+            #end if
+            if len(boundaries) < 2 :
+                boundaries = () # whole curve is one subcurve, even across wraparound
             #end if
-            last_subcurve = this_subcurve
+            # find all boundaries strictly within the range of steps to be drawn,
+            # allowing for wraparound
+            breaks = []
+            for wrap in range(n_start // nr_steps * nr_steps, n_end, nr_steps) :
+                breaks.extend(wrap + i for i in boundaries if n_start < wrap + i < n_end)
+            #end for
+            breaks.append(n_end)
+            run_start = n_start
+            for run_end in breaks :
+                if run_start != n_start :
+                    break_subcurve()
+                #end if
+                for i in range(run_start, run_end) :
+                    g.line_to(f(i % nr_steps))
+                #end for
+                run_start = run_end
+            #end for
+        #end if
+        if closed and n_start % nr_steps == n_end % nr_steps :
+            g.close_path()
         #end if
-        g.line_to(f(i % nr_steps))
-    #end for
-    if last_subcurve != None and closed and n_start % nr_steps == end % nr_steps :
-        g.close_path()
     #end if
     g.stroke()
 #end draw_curve_discrete
@@ -639,9 +988,339 @@ class FrameTimeCalc :
         #end for
     #end each_frame
 
+    def each_frame_in(self, intervals, final_partial = False) :
+        "iterates (time, framenr) tuples over just those frames overlapping the" \
+        " given sequence of (from_time, to_time) intervals, such as returned from" \
+        " time_changes."
+        from_frame_nr = self.start_frame_nr
+        to_frame_nr = self.time_to_frame(self.end_time, round_up = final_partial)
+        frame_nrs = set()
+        for from_time, to_time in intervals :
+            from_time = max(from_time, self.start_time)
+            to_time = min(to_time, self.end_time)
+            if from_time <= to_time :
+                frame_nrs.update \
+                  (
+                    range
+                      (
+                        max(self.time_to_frame(from_time), from_frame_nr),
+                        min(self.time_to_frame(to_time) + 1, to_frame_nr)
+                      )
+                  )
+            #end if
+        #end for
+        for frame_nr in sorted(frame_nrs) :
+            yield (self.frame_to_time(frame_nr), frame_nr)
+        #end for
+    #end each_frame_in
+
 #end FrameTimeCalc
 
-def render_anim \
+class FrameAccumulator :
+    "accumulates successive renderings into the ARGB32 qahirah.ImageSurface pix," \
+    " for averaging them together, e.g. for motion blur. The pixel components" \
+    " are summed exactly, and only rounded once when the average is written back" \
+    " into pix.\n" \
+    "\n" \
+    "To avoid a Python-level loop over pixels, the accumulator is held as a" \
+    " single big integer with a 32-bit lane for each byte of the image; the" \
+    " image bytes are spread out into these lanes with one extended-slice" \
+    " assignment, after which whole images can be added, scaled and rounded" \
+    " using big-integer arithmetic, and extracted again with another slice."
+
+    def __init__(self, pix) :
+        self.pix = pix
+        self.nr_bytes = pix.stride * pix.height
+        self.lanes = bytearray(4 * self.nr_bytes)
+        self.rounding = int.from_bytes(bytes((0, 0, 0x80, 0)) * self.nr_bytes, "little")
+          # half of the 2 ** 24 scale factor used in resolve, in every lane
+        self.total = 0
+        self.count = 0
+    #end __init__
+
+    def add(self) :
+        "adds the current contents of pix into the accumulator."
+        self.pix.flush()
+        self.lanes[0::4] = ct.string_at(self.pix.data, self.nr_bytes)
+        self.total += int.from_bytes(self.lanes, "little")
+        self.count += 1
+    #end add
+
+    def resolve(self) :
+        "replaces the contents of pix with the average of all the renderings" \
+        " added since the last resolve."
+        # scale each lane by 2 ** 24 / count, so that the rounded average ends up
+        # in the top byte of each lane. Sums are at most 255 * count, so this
+        # cannot overflow into the next lane.
+        scale = round((1 << 24) / self.count)
+        averaged = (self.total * scale + self.rounding).to_bytes(4 * self.nr_bytes, "little")
+        ct.memmove(self.pix.data, averaged[3::4], self.nr_bytes)
+        self.pix.mark_dirty()
+        self.total = 0
+        self.count = 0
+    #end resolve
+
+#end FrameAccumulator
+
+class FrameRenderer :
+    "random-access rendering of individual frames of an animation, for example for" \
+    " interactive scrubbing. dimensions, start_time, end_time, frame_rate, draw_frame," \
+    " overall_presetup and start_frame_nr have the same meanings as for render_anim." \
+    " Rendered frames are kept in memory, up to a total of cache_limit bytes," \
+    " discarding the least recently used ones as necessary. If prefetch_frames is" \
+    " nonzero, then each call to render_frame also starts background rendering of" \
+    " up to that many frames on either side of the requested one, cancelling any" \
+    " queued prefetches that are no longer within that range; in this case," \
+    " draw_frame must be safe to call from another thread, and must not depend" \
+    " on frames being drawn in order, and close should be called when finished with" \
+    " the FrameRenderer, to shut down the background rendering thread."
+
+    def __init__ \
+      (
+        self,
+        dimensions,
+        start_time,
+        end_time,
+        frame_rate,
+        draw_frame,
+        overall_presetup,
+        start_frame_nr,
+        cache_limit = 256 * 1024 * 1024,
+        prefetch_frames = 0
+      ) :
+        self.dimensions = dimensions
+        self.draw_frame = draw_frame
+        self.overall_presetup = overall_presetup
+        self.frame_times = FrameTimeCalc \
+          (
+            start_time = start_time,
+            end_time = end_time,
+            frame_rate = frame_rate,
+            start_frame_nr = start_frame_nr,
+          )
+        self.end_frame_nr = self.frame_times.time_to_frame(end_time)
+        self.cache_limit = cache_limit
+        self.frame_cache = collections.OrderedDict() # mapping from frame nr to ImageSurface
+        self.frame_cache_size = 0
+        self.cache_lock = threading.Lock()
+        self.prefetch_frames = prefetch_frames
+        self.prefetching = {} # mapping from frame nr to Future for frames being rendered
+        if prefetch_frames != 0 :
+            self.prefetcher = concurrent.futures.ThreadPoolExecutor(max_workers = 1)
+        else :
+            self.prefetcher = None
+        #end if
+    #end __init__
+
+    def make_frame(self, frame_nr) :
+        "renders the frame with the specified number into a new qahirah.ImageSurface."
+        pix = qah.ImageSurface.create(qah.CAIRO.FORMAT_ARGB32, self.dimensions)
+        g = qah.Context.create(pix)
+        if self.overall_presetup != None :
+            self.overall_presetup(g)
+        #end if
+        self.draw_frame(g, self.frame_times.frame_to_time(frame_nr))
+        pix.flush()
+        return \
+            pix
+    #end make_frame
+
+    def cache_frame(self, frame_nr, pix) :
+        "adds pix to the frame cache, discarding the least recently used" \
+        " entries as necessary to stay within cache_limit."
+        with self.cache_lock :
+            if frame_nr not in self.frame_cache :
+                self.frame_cache[frame_nr] = pix
+                self.frame_cache_size += pix.stride * pix.height
+                while self.frame_cache_size > self.cache_limit and len(self.frame_cache) > 1 :
+                    _, discard = self.frame_cache.popitem(last = False)
+                    self.frame_cache_size -= discard.stride * discard.height
+                #end while
+            #end if
+        #end with
+    #end cache_frame
+
+    def get_frame(self, frame_nr) :
+        "returns a qahirah.ImageSurface holding the frame with the specified number," \
+        " rendering it if it is not already cached. The caller must not draw into the" \
+        " returned surface, since it may be returned again by later calls."
+        with self.cache_lock :
+            pix = self.frame_cache.get(frame_nr)
+            if pix != None :
+                self.frame_cache.move_to_end(frame_nr)
+            #end if
+            pending = self.prefetching.get(frame_nr)
+            if pix == None and pending != None and pending.cancel() :
+                # not started yet, and may be stuck behind other queued frames:
+                # quicker to render it here than to wait
+                del self.prefetching[frame_nr]
+                pending = None
+            #end if
+            if self.prefetcher != None :
+                self.cancel_prefetches(frame_nr)
+            #end if
+        #end with
+        if pix == None :
+            if pending != None :
+                pix = pending.result()
+            else :
+                pix = self.make_frame(frame_nr)
+                self.cache_frame(frame_nr, pix)
+            #end if
+        #end if
+        if self.prefetcher != None :
+            self.prefetch(frame_nr)
+        #end if
+        return \
+            pix
+    #end get_frame
+
+    def cancel_prefetches(self, frame_nr) :
+        # cancels any queued prefetches that are no longer within prefetch_frames
+        # of frame_nr. Must be called with cache_lock held.
+        for other_nr, pending in list(self.prefetching.items()) :
+            if abs(other_nr - frame_nr) > self.prefetch_frames and pending.cancel() :
+                del self.prefetching[other_nr]
+            #end if
+        #end for
+    #end cancel_prefetches
+
+    def render_frame(self, t) :
+        "returns a qahirah.ImageSurface holding the frame visible at time t, which is" \
+        " clamped to the range of the animation. The same caveat applies as for get_frame."
+        return \
+            self.get_frame \
+              (
+                min
+                  (
+                    max(self.frame_times.time_to_frame(t), self.frame_times.start_frame_nr),
+                    self.end_frame_nr - 1
+                  )
+              )
+    #end render_frame
+
+    def prefetch_frame(self, frame_nr) :
+        # runs on background thread to render a frame ahead of time.
+        try :
+            pix = self.make_frame(frame_nr)
+            self.cache_frame(frame_nr, pix)
+        finally :
+            with self.cache_lock :
+                self.prefetching.pop(frame_nr, None) # might have been cleared by close
+            #end with
+        #end try
+        return \
+            pix
+    #end prefetch_frame
+
+    def prefetch(self, frame_nr) :
+        "starts background rendering of frames within prefetch_frames of frame_nr," \
+        " nearest ones first."
+        for i in range(1, self.prefetch_frames + 1) :
+            for neighbour in (frame_nr + i, frame_nr - i) :
+                if self.frame_times.start_frame_nr <= neighbour < self.end_frame_nr :
+                    with self.cache_lock :
+                        if (
+                                self.prefetcher != None # not closed meanwhile
+                            and
+                                neighbour not in self.frame_cache
+                            and
+                                neighbour not in self.prefetching
+                        ) :
+                            self.prefetching[neighbour] = self.prefetcher.submit(self.prefetch_frame, neighbour)
+                        #end if
+                    #end with
+                #end if
+            #end for
+        #end for
+    #end prefetch
+
+    def close(self) :
+        "stops background prefetching, cancelling any queued prefetches and waiting" \
+        " for one in progress to finish. Frames can still be rendered afterwards, but" \
+        " there will be no more prefetching."
+        with self.cache_lock :
+            prefetcher = self.prefetcher
+            self.prefetcher = None
+            for pending in self.prefetching.values() :
+                pending.cancel()
+            #end for
+            self.prefetching.clear()
+        #end with
+        if prefetcher != None :
+            prefetcher.shutdown() # outside lock, since a running prefetch needs it
+        #end if
+    #end close
+
+#end FrameRenderer
+
+class QualityController :
+    "adjusts the level of detail of drawing, to try to keep the time taken to draw" \
+    " each frame within budget seconds, for example for real-time preview. The current" \
+    " level is given by quality, which is a factor in [min_quality, 1]. Use scaled" \
+    " to wrap the nr_steps arguments to the make_draw routines for curves (or any" \
+    " similar count of samples), and wrap_draw to wrap the overall draw procedure," \
+    " so the time taken for each frame can be measured and the quality adjusted for" \
+    " the next one. Quality is lowered as soon as a frame goes over budget, and raised" \
+    " again gradually when there is time to spare. The quality at which the frame" \
+    " for each time was drawn is recorded in the frame_quality dict."
+
+    smoothing = 0.25 # weight given to each new draw time measurement
+    headroom = 0.9 # fraction of budget to aim for
+    raise_step = 1.25 # maximum factor by which quality can be raised per frame
+    min_cost = 1e-6 # lower limit on draw time measurements, to avoid dividing by zero
+
+    def __init__(self, budget, min_quality = 0.1) :
+        self.budget = budget
+        self.min_quality = min_quality
+        self.quality = 1
+        self.cost = None # smoothed estimate of draw time at full quality
+        self.frame_quality = {} # mapping from frame time to quality
+    #end __init__
+
+    def scaled(self, nr_steps, min_steps = 3) :
+        "returns an interpolator which evaluates nr_steps (an interpolator or a" \
+        " constant), scaled by the quality current at the time of evaluation."
+        nr_steps = ensure_interpolator(nr_steps)
+        return \
+            interpolator(lambda x : max(round(nr_steps(x) * self.quality), min_steps))
+    #end scaled
+
+    def record(self, t, draw_time) :
+        "records that the frame for time t took draw_time seconds to draw at the" \
+        " current quality, and adjusts the quality for the next frame accordingly."
+        self.frame_quality[t] = self.quality
+        cost = max(draw_time, self.min_cost) / self.quality
+          # assuming time is proportional to quality
+        if self.cost == None or draw_time > self.budget :
+            self.cost = max(cost, self.cost or 0)
+        else :
+            self.cost += (cost - self.cost) * self.smoothing
+        #end if
+        self.quality = max \
+          (
+            min(self.budget * self.headroom / self.cost, self.quality * self.raise_step, 1),
+            self.min_quality
+          )
+    #end record
+
+    def wrap_draw(self, draw) :
+        "returns a draw procedure which invokes draw, and records how long it took."
+
+        def apply_draw(g, x) :
+            draw_start = time.perf_counter()
+            draw(g, x)
+            self.record(x, time.perf_counter() - draw_start)
+        #end apply_draw
+
+    #begin wrap_draw
+        return \
+            apply_draw
+    #end wrap_draw
+
+#end QualityController
+
+def render_frames \
   (
     dimensions, # qahirah.Vector
     start_time,
@@ -649,15 +1328,140 @@ def render_anim \
     frame_rate,
     draw_frame, # draw procedure
     overall_presetup, # called to do once-off setup of qahirah Context
-    out_dir, # where to write numbered PNG frames
-    start_frame_nr # frame number corresponding to time 0
+    start_frame_nr, # frame number corresponding to time 0
+    motion_blur_samples = 1, # number of sub-frame times to render and average per frame
+    shutter_angle = 180, # fraction of frame interval, in degrees, covered by sub-frame times
+    frames = None, # sequence of (time, frame_nr) to render, defaults to all
   ) :
-    "renders out an animation to a sequence of PNG image files."
+    "generator which renders the frames of an animation one by one, yielding" \
+    " (frame_nr, t, pix) tuples, where pix is the qahirah.ImageSurface holding the" \
+    " frame. The same surface is reused for every frame, so its contents are only" \
+    " valid until the generator is resumed. The arguments have the same meanings" \
+    " as for render_anim."
     pix = qah.ImageSurface.create(qah.CAIRO.FORMAT_ARGB32, dimensions)
     g = qah.Context.create(pix)
     if overall_presetup != None :
         overall_presetup(g)
     #end if
+    if motion_blur_samples > 1 :
+        accumulator = FrameAccumulator(pix)
+    else :
+        accumulator = None
+    #end if
+    if frames == None :
+        frames = FrameTimeCalc \
+          (
+            start_time = start_time,
+            end_time = end_time,
+            frame_rate = frame_rate,
+            start_frame_nr = start_frame_nr,
+          ).each_frame()
+    #end if
+    for t, frame_nr in frames :
+        if accumulator != None :
+            for i in range(motion_blur_samples) :
+                g.save()
+                draw_frame(g, t + i / motion_blur_samples * shutter_angle / 360 / frame_rate)
+                g.restore()
+                accumulator.add()
+            #end for
+            accumulator.resolve()
+        else :
+            g.save()
+            draw_frame(g, t)
+            g.restore()
+        #end if
+        pix.flush()
+        yield frame_nr, t, pix
+    #end for
+#end render_frames
+
+def iter_frames \
+  (
+    dimensions, # qahirah.Vector
+    start_time,
+    end_time,
+    frame_rate,
+    draw_frame, # draw procedure
+    overall_presetup, # called to do once-off setup of qahirah Context
+    start_frame_nr, # frame number corresponding to time 0
+    motion_blur_samples = 1, # number of sub-frame times to render and average per frame
+    shutter_angle = 180, # fraction of frame interval, in degrees, covered by sub-frame times
+  ) :
+    "generator which renders the frames of an animation in memory, as an alternative" \
+    " to render_anim writing them to PNG files. Yields (frame_nr, t, data) tuples," \
+    " where data is a read-only memoryview of shape (height, stride) directly onto" \
+    " the pixels of the rendered frame, in Cairo’s FORMAT_ARGB32 layout (32-bit" \
+    " native-endian premultiplied-alpha pixels, each row padded to stride bytes).\n" \
+    "\n" \
+    "No copy is made: the same buffer is reused for every frame, so data is only valid" \
+    " until the generator is resumed, and must not be used after that. A consumer" \
+    " that needs to keep a frame for longer must make its own copy, e.g. with" \
+    " bytes(data)."
+    data = None
+    for frame_nr, t, pix in render_frames \
+      (
+        dimensions = dimensions,
+        start_time = start_time,
+        end_time = end_time,
+        frame_rate = frame_rate,
+        draw_frame = draw_frame,
+        overall_presetup = overall_presetup,
+        start_frame_nr = start_frame_nr,
+        motion_blur_samples = motion_blur_samples,
+        shutter_angle = shutter_angle,
+      ) \
+    :
+        if data == None :
+            # same surface every time, so the same view can be reused
+            data = memoryview((ct.c_ubyte * (pix.stride * pix.height)).from_address(pix.data)) \
+                .cast("B", (pix.height, pix.stride)).toreadonly()
+        #end if
+        yield frame_nr, t, data
+    #end for
+#end iter_frames
+
+def render_anim \
+  (
+    dimensions, # qahirah.Vector
+    start_time,
+    end_time,
+    frame_rate,
+    draw_frame, # draw procedure
+    overall_presetup, # called to do once-off setup of qahirah Context
+    out_dir, # where to write numbered PNG frames
+    start_frame_nr, # frame number corresponding to time 0
+    motion_blur_samples = 1, # number of sub-frame times to render and average per frame
+    shutter_angle = 180, # fraction of frame interval, in degrees, covered by sub-frame times
+    previous_draw_frame = None, # draw procedure from which existing frames were rendered
+    extra_outputs = (), # sequence of (dimensions, out_dir) for smaller copies of each frame
+    frame_store = None, # e.g. framestore.FrameStoreWriter, to save frames instead of out_dir
+  ) :
+    "renders out an animation to a sequence of PNG image files. If motion_blur_samples" \
+    " is more than 1, then each frame is the average of that many renderings at times" \
+    " spread over the part of the frame interval given by shutter_angle. If" \
+    " previous_draw_frame is specified, then out_dir is assumed to already hold" \
+    " the frames rendered from it, and only those frames which time_changes" \
+    " indicates could be different with draw_frame are rendered again.\n" \
+    "\n" \
+    "Each element of extra_outputs specifies another, smaller size at which the" \
+    " animation is to be output, and the directory in which to put the frames at that" \
+    " size. Each frame is only drawn once, at the full dimensions, and the smaller" \
+    " versions are downscaled from that.\n" \
+    "\n" \
+    "If frame_store is specified, it must be an object with a write_frame(frame_nr, t, pix)" \
+    " method, which is called with each full-size frame; out_dir can then be None, if" \
+    " PNG files are not wanted as well."
+    downscales = []
+    for out_dimensions, out_out_dir in extra_outputs :
+        out_dimensions = qah.Vector.from_tuple(out_dimensions)
+        assert out_dimensions.x <= dimensions.x and out_dimensions.y <= dimensions.y
+        out_pix = qah.ImageSurface.create(qah.CAIRO.FORMAT_ARGB32, out_dimensions)
+        out_g = qah.Context.create(out_pix)
+        out_g.scale((out_dimensions.x / dimensions.x, out_dimensions.y / dimensions.y))
+        out_g.set_operator(qah.CAIRO.OPERATOR_SOURCE)
+        downscales.append((out_pix, out_g, out_out_dir))
+    #end for
     frame_times = FrameTimeCalc \
       (
         start_time = start_time,
@@ -672,20 +1476,48 @@ def render_anim \
     if show_progress :
         last_time = time.time()
     #end if
-    for t, frame_nr in \
-        frame_times.each_frame \
+    if previous_draw_frame != None :
+        frames = frame_times.each_frame_in \
           (
+            intervals = time_changes(previous_draw_frame, draw_frame, start_time, end_time),
             final_partial = final_partial
-          ) \
-    :
-        g.save()
-        draw_frame(g, t)
-        g.restore()
-        pix.flush()
-        pix.write_to_png \
-          (
-            os.path.join(out_dir, "{:04d}.png".format(frame_nr))
           )
+    else :
+        frames = frame_times.each_frame(final_partial = final_partial)
+    #end if
+    for frame_nr, t, pix in render_frames \
+      (
+        dimensions = dimensions,
+        start_time = start_time,
+        end_time = end_time,
+        frame_rate = frame_rate,
+        draw_frame = draw_frame,
+        overall_presetup = overall_presetup,
+        start_frame_nr = start_frame_nr,
+        motion_blur_samples = motion_blur_samples,
+        shutter_angle = shutter_angle,
+        frames = frames,
+      ) \
+    :
+        if frame_store != None :
+            frame_store.write_frame(frame_nr, t, pix)
+        #end if
+        if out_dir != None :
+            pix.write_to_png \
+              (
+                os.path.join(out_dir, "{:04d}.png".format(frame_nr))
+              )
+        #end if
+        for out_pix, out_g, out_out_dir in downscales :
+            out_g.set_source_surface(pix, (0, 0))
+            out_g.source.set_filter(qah.CAIRO.FILTER_GOOD)
+            out_g.paint()
+            out_pix.flush()
+            out_pix.write_to_png \
+              (
+                os.path.join(out_out_dir, "{:04d}.png".format(frame_nr))
+              )
+        #end for
         if show_progress and time.time() - last_time >= 5.0 :
             last_time = time.time()
             sys.stderr.write \
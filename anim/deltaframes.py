@@ -0,0 +1,254 @@
+#+
+# Storage of rendered animation frames as periodic full keyframes plus,
+# in between, just the rectangles that changed from the previous frame.
+#
+# Copyright 2026 by Lawrence D'Oliveiro <ldo@geek-central.gen.nz>.
+# Licensed under CC-BY-SA <http://creativecommons.org/licenses/by-sa/4.0/>.
+#-
+
+import struct
+import zlib
+import ctypes as ct
+import qahirah as qah
+from qahirah import \
+    CAIRO, \
+    Rect, \
+    Vector
+
+#+
+# File layout: a header, followed by a record for each frame in the order
+# written. Each frame record is followed by the given number of rectangle
+# records, each of which is followed by the zlib-compressed pixels of that
+# rectangle, row by row, without any padding. A keyframe has a single
+# rectangle covering the whole image; a delta frame has a rectangle for each
+# band of rows that changed from the previous frame, which can be none at all.
+#-
+
+header_struct = struct.Struct("<4sIIIII")
+  # magic, version, format, width, height, stride
+frame_struct = struct.Struct("<idBI")
+  # frame_nr, time, is keyframe, nr rectangles
+rect_struct = struct.Struct("<IIIII")
+  # left, top, width, height, compressed length
+magic = b"DLTA"
+version = 1
+bytes_per_pixel = 4
+
+def changed_rects(old, new, stride, height) :
+    "old and new are bytes-like objects holding two images with the specified stride" \
+    " and height, in a 32-bit-per-pixel format. Returns a list of Rects covering the" \
+    " pixels that differ between them, one for each run of consecutive rows with" \
+    " differences."
+    rects = []
+    old = memoryview(old)
+    new = memoryview(new)
+    band_top = None
+    for row in range(height + 1) :
+        if row < height :
+            old_row = old[row * stride : (row + 1) * stride]
+            new_row = new[row * stride : (row + 1) * stride]
+            changed = old_row != new_row
+        else :
+            changed = False
+        #end if
+        if changed :
+            # locate first and last differing bytes in row from the lowest and
+            # highest set bits of the XOR of the two rows
+            diff = int.from_bytes(old_row, "little") ^ int.from_bytes(new_row, "little")
+            first = ((diff & - diff).bit_length() - 1) // bytes_per_pixel // 8
+            last = (diff.bit_length() - 1) // bytes_per_pixel // 8
+            if band_top == None :
+                band_top = row
+                band_left = first
+                band_right = last
+            else :
+                band_left = min(band_left, first)
+                band_right = max(band_right, last)
+            #end if
+        elif band_top != None :
+            rects.append(Rect(band_left, band_top, band_right - band_left + 1, row - band_top))
+            band_top = None
+        #end if
+    #end for
+    return \
+        rects
+#end changed_rects
+
+class DeltaFrameWriter :
+    "writes successive frames to a file with the specified name, as a full keyframe" \
+    " every keyframe_interval frames, and in between, only the rectangles that changed" \
+    " from the previous frame, so the output size and the compression time depend on" \
+    " the amount of motion rather than on the image size. Frames must be written in" \
+    " order. compress_level is the zlib compression level. Pass an instance to" \
+    " common.render_anim as its frame_store argument to have rendered frames saved here."
+
+    def __init__(self, filename, dimensions, keyframe_interval = 30, compress_level = 6, format = CAIRO.FORMAT_ARGB32) :
+        if format not in (CAIRO.FORMAT_ARGB32, CAIRO.FORMAT_RGB24) :
+            raise ValueError("only 32-bit pixel formats are supported")
+        #end if
+        dimensions = Vector.from_tuple(dimensions)
+        self.format = format
+        self.width = dimensions.x
+        self.height = dimensions.y
+        self.stride = qah.ImageSurface.format_stride_for_width(format, self.width)
+        self.keyframe_interval = keyframe_interval
+        self.compress_level = compress_level
+        self.prev_frame = None
+        self.since_keyframe = 0
+        self.outfile = open(filename, "wb")
+        self.outfile.write \
+          (
+            header_struct.pack(magic, version, format, self.width, self.height, self.stride)
+          )
+    #end __init__
+
+    def write_rect(self, data, rect) :
+        "writes out the rectangle record and compressed pixels for the specified" \
+        " part of the image data."
+        pixels = b"".join \
+          (
+            data
+              [
+                row * self.stride + rect.left * bytes_per_pixel
+              :
+                row * self.stride + (rect.left + rect.width) * bytes_per_pixel
+              ]
+            for row in range(rect.top, rect.top + rect.height)
+          )
+        compressed = zlib.compress(pixels, self.compress_level)
+        self.outfile.write(rect_struct.pack(rect.left, rect.top, rect.width, rect.height, len(compressed)))
+        self.outfile.write(compressed)
+    #end write_rect
+
+    def write_frame(self, frame_nr, t, pix) :
+        "writes out the contents of the qahirah.ImageSurface pix as the frame with the" \
+        " specified number and time."
+        if (pix.format, pix.width, pix.height, pix.stride) != (self.format, self.width, self.height, self.stride) :
+            raise ValueError("surface does not match delta frame file")
+        #end if
+        pix.flush()
+        data = ct.string_at(pix.data, self.stride * self.height)
+        is_keyframe = self.prev_frame == None or self.since_keyframe >= self.keyframe_interval
+        if is_keyframe :
+            rects = [Rect(0, 0, self.width, self.height)]
+            self.since_keyframe = 0
+        elif data == self.prev_frame :
+            rects = []
+        else :
+            rects = changed_rects(self.prev_frame, data, self.stride, self.height)
+        #end if
+        self.since_keyframe += 1
+        self.outfile.write(frame_struct.pack(frame_nr, t, is_keyframe, len(rects)))
+        for rect in rects :
+            self.write_rect(data, rect)
+        #end for
+        self.prev_frame = data
+    #end write_frame
+
+    def close(self) :
+        self.outfile.close()
+    #end close
+
+#end DeltaFrameWriter
+
+class DeltaFrameReader :
+    "gives access to the frames in a file previously written by DeltaFrameWriter." \
+    " The file is scanned on opening to index the frame records; reconstructing a" \
+    " frame starts from the nearest preceding keyframe, or from the last frame" \
+    " returned if that is closer, so reading frames in order is cheap."
+
+    def __init__(self, filename) :
+        self.infile = open(filename, "rb")
+        header = self.infile.read(header_struct.size)
+        if len(header) < header_struct.size :
+            raise ValueError("not a delta frame file: %s" % filename)
+        #end if
+        file_magic, file_version, self.format, self.width, self.height, self.stride = \
+            header_struct.unpack(header)
+        if file_magic != magic or file_version != version :
+            raise ValueError("not a delta frame file: %s" % filename)
+        #end if
+        self.frames = [] # list of (frame_nr, t, is_keyframe, file offset) in order written
+        self.frame_positions = {} # mapping from frame_nr to index in frames
+        while True :
+            offset = self.infile.tell()
+            record = self.infile.read(frame_struct.size)
+            if len(record) == 0 :
+                break
+            #end if
+            if len(record) < frame_struct.size :
+                raise ValueError("delta frame file is truncated: %s" % filename)
+            #end if
+            frame_nr, t, is_keyframe, nr_rects = frame_struct.unpack(record)
+            for i in range(nr_rects) :
+                rect_record = self.infile.read(rect_struct.size)
+                if len(rect_record) < rect_struct.size :
+                    raise ValueError("delta frame file is truncated: %s" % filename)
+                #end if
+                self.infile.seek(rect_struct.unpack(rect_record)[4], 1)
+            #end for
+            self.frame_positions[frame_nr] = len(self.frames)
+            self.frames.append((frame_nr, t, is_keyframe != 0, offset))
+        #end while
+        self.pix = qah.ImageSurface.create(self.format, Vector(self.width, self.height))
+        self.current = None # index in frames of contents of pix
+    #end __init__
+
+    def frame_nrs(self) :
+        "returns the numbers of the frames in the file, in the order written."
+        return \
+            list(f[0] for f in self.frames)
+    #end frame_nrs
+
+    def frame_time(self, frame_nr) :
+        "returns the animation time of the specified frame."
+        return \
+            self.frames[self.frame_positions[frame_nr]][1]
+    #end frame_time
+
+    def apply_frame(self, index) :
+        "updates pix with the rectangles from the specified frame record."
+        self.infile.seek(self.frames[index][3])
+        nr_rects = frame_struct.unpack(self.infile.read(frame_struct.size))[3]
+        for i in range(nr_rects) :
+            left, top, width, height, length = rect_struct.unpack(self.infile.read(rect_struct.size))
+            pixels = zlib.decompress(self.infile.read(length))
+            row_bytes = width * bytes_per_pixel
+            for row in range(height) :
+                ct.memmove \
+                  (
+                    self.pix.data + (top + row) * self.stride + left * bytes_per_pixel,
+                    pixels[row * row_bytes : (row + 1) * row_bytes],
+                    row_bytes
+                  )
+            #end for
+        #end for
+    #end apply_frame
+
+    def surface(self, frame_nr) :
+        "returns a qahirah.ImageSurface holding the reconstructed contents of the" \
+        " specified frame. The same surface is reused for every call, so its contents" \
+        " are only valid until the next call, and it must not be drawn into."
+        index = self.frame_positions[frame_nr]
+        start = index
+        while not self.frames[start][2] :
+            start -= 1
+        #end while
+        if self.current != None and start <= self.current <= index :
+            start = self.current + 1
+        #end if
+        self.pix.flush()
+        for i in range(start, index + 1) :
+            self.apply_frame(i)
+        #end for
+        self.pix.mark_dirty()
+        self.current = index
+        return \
+            self.pix
+    #end surface
+
+    def close(self) :
+        self.infile.close()
+    #end close
+
+#end DeltaFrameReader
@@ -0,0 +1,208 @@
+#+
+# Storage of rendered animation frames as raw pixels in a single
+# memory-mapped file, as an alternative to a directory of PNG files.
+#
+# Copyright 2026 by Lawrence D'Oliveiro <ldo@geek-central.gen.nz>.
+# Licensed under CC-BY-SA <http://creativecommons.org/licenses/by-sa/4.0/>.
+#-
+
+import struct
+import mmap
+import ctypes as ct
+import qahirah as qah
+from qahirah import \
+    CAIRO, \
+    Vector
+
+#+
+# File layout: a header, followed by an index with one entry per frame
+# slot, followed (at a page-aligned offset) by the fixed-size frame slots
+# themselves, each holding the raw pixels exactly as laid out in a Cairo
+# ImageSurface of the given format, width, height and stride.
+#-
+
+header_struct = struct.Struct("<4sIIIIIiIQ")
+  # magic, version, format, width, height, stride, start_frame_nr, nr_frames, data_offset
+index_struct = struct.Struct("<dI4x")
+  # frame time, nonzero if frame present
+magic = b"FRMS"
+version = 1
+
+def frame_store_layout(stride, height, nr_frames) :
+    "returns (frame_size, data_offset, total_size) for a frame store with the" \
+    " specified parameters."
+    frame_size = stride * height
+    data_offset = \
+        (
+            (header_struct.size + nr_frames * index_struct.size + mmap.PAGESIZE - 1)
+        //
+            mmap.PAGESIZE
+        *
+            mmap.PAGESIZE
+        )
+    return \
+        (frame_size, data_offset, data_offset + nr_frames * frame_size)
+#end frame_store_layout
+
+class FrameStoreWriter :
+    "creates a frame store file with the specified name, with room for nr_frames" \
+    " frames of the specified dimensions and pixel format, numbered from" \
+    " start_frame_nr. The whole file is allocated and memory-mapped up front, and" \
+    " frames can be written into it in any order. Pass an instance to" \
+    " common.render_anim as its frame_store argument to have rendered frames saved here."
+
+    def __init__(self, filename, dimensions, start_frame_nr, nr_frames, format = CAIRO.FORMAT_ARGB32) :
+        dimensions = Vector.from_tuple(dimensions)
+        self.format = format
+        self.width = dimensions.x
+        self.height = dimensions.y
+        self.stride = qah.ImageSurface.format_stride_for_width(format, self.width)
+        self.start_frame_nr = start_frame_nr
+        self.nr_frames = nr_frames
+        self.frame_size, self.data_offset, total_size = \
+            frame_store_layout(self.stride, self.height, nr_frames)
+        with open(filename, "w+b") as outfile :
+            outfile.truncate(total_size)
+            self.map = mmap.mmap(outfile.fileno(), total_size)
+        #end with
+        header_struct.pack_into \
+          (
+            self.map,
+            0,
+            magic,
+            version,
+            format,
+            self.width,
+            self.height,
+            self.stride,
+            start_frame_nr,
+            nr_frames,
+            self.data_offset
+          )
+    #end __init__
+
+    def write_frame(self, frame_nr, t, pix) :
+        "copies the contents of the qahirah.ImageSurface pix into the slot for the" \
+        " specified frame number, and records it as being the frame for time t."
+        index = frame_nr - self.start_frame_nr
+        if index < 0 or index >= self.nr_frames :
+            raise IndexError("frame %d not in range of frame store" % frame_nr)
+        #end if
+        if (pix.format, pix.width, pix.height, pix.stride) != (self.format, self.width, self.height, self.stride) :
+            raise ValueError("surface does not match frame store")
+        #end if
+        pix.flush()
+        offset = self.data_offset + index * self.frame_size
+        self.map[offset : offset + self.frame_size] = \
+            (ct.c_ubyte * self.frame_size).from_address(pix.data)
+        index_struct.pack_into(self.map, header_struct.size + index * index_struct.size, t, 1)
+    #end write_frame
+
+    def close(self) :
+        "flushes all frames to the file and closes it."
+        self.map.flush()
+        self.map.close()
+    #end close
+
+#end FrameStoreWriter
+
+class FrameStoreReader :
+    "gives random access to the frames in a file previously written by FrameStoreWriter." \
+    " The file is memory-mapped, so frames are only read from disk as they are accessed."
+
+    def __init__(self, filename) :
+        with open(filename, "rb") as infile :
+            self.map = mmap.mmap(infile.fileno(), 0, access = mmap.ACCESS_READ)
+        #end with
+        if len(self.map) < header_struct.size :
+            raise ValueError("not a frame store file: %s" % filename)
+        #end if
+        file_magic, file_version, self.format, self.width, self.height, self.stride, \
+            self.start_frame_nr, self.nr_frames, self.data_offset = \
+            header_struct.unpack_from(self.map, 0)
+        if file_magic != magic or file_version != version :
+            raise ValueError("not a frame store file: %s" % filename)
+        #end if
+        self.frame_size, _, total_size = frame_store_layout(self.stride, self.height, self.nr_frames)
+        if len(self.map) < total_size :
+            raise ValueError("frame store file is truncated: %s" % filename)
+        #end if
+        self.data = memoryview(self.map)
+    #end __init__
+
+    def frame_index(self, frame_nr) :
+        "returns the (time, present) index entry for the specified frame number."
+        index = frame_nr - self.start_frame_nr
+        if index < 0 or index >= self.nr_frames :
+            raise IndexError("frame %d not in range of frame store" % frame_nr)
+        #end if
+        return \
+            index_struct.unpack_from(self.map, header_struct.size + index * index_struct.size)
+    #end frame_index
+
+    def frame_nrs(self) :
+        "iterates over the numbers of the frames that have actually been written."
+        for frame_nr in range(self.start_frame_nr, self.start_frame_nr + self.nr_frames) :
+            if self.frame_index(frame_nr)[1] != 0 :
+                yield frame_nr
+            #end if
+        #end for
+    #end frame_nrs
+
+    def frame_time(self, frame_nr) :
+        "returns the animation time of the specified frame, or None if it has not" \
+        " been written."
+        t, present = self.frame_index(frame_nr)
+        return \
+            (None, t)[present != 0]
+    #end frame_time
+
+    def frame_data(self, frame_nr) :
+        "returns a 1-dimensional read-only memoryview of the bytes of the specified" \
+        " frame in the file, or None if it has not been written."
+        if self.frame_index(frame_nr)[1] != 0 :
+            offset = self.data_offset + (frame_nr - self.start_frame_nr) * self.frame_size
+            result = self.data[offset : offset + self.frame_size]
+        else :
+            result = None
+        #end if
+        return \
+            result
+    #end frame_data
+
+    def frame(self, frame_nr) :
+        "returns a read-only memoryview of shape (height, stride) directly onto the" \
+        " pixels of the specified frame in the file, or None if it has not been" \
+        " written. No copy is made; the view must be released before calling close."
+        result = self.frame_data(frame_nr)
+        if result != None :
+            result = result.cast("B", (self.height, self.stride))
+        #end if
+        return \
+            result
+    #end frame
+
+    def surface(self, frame_nr) :
+        "returns a new qahirah.ImageSurface holding a copy of the specified frame," \
+        " e.g. for writing out to a PNG file, or None if it has not been written."
+        data = self.frame_data(frame_nr)
+        if data != None :
+            pix = qah.ImageSurface.create(self.format, Vector(self.width, self.height))
+            pix.flush()
+            memoryview((ct.c_ubyte * self.frame_size).from_address(pix.data)).cast("B")[:] = data
+            data.release()
+            pix.mark_dirty()
+        else :
+            pix = None
+        #end if
+        return \
+            pix
+    #end surface
+
+    def close(self) :
+        "closes the file. Any views returned from frame must have been released first."
+        self.data.release()
+        self.map.close()
+    #end close
+
+#end FrameStoreReader
@@ -8,12 +8,32 @@
 #-
 
 import math
-from fractions import \
-    gcd
+import functools
 import qahirah as qah
 from . import \
     common
 
+@functools.lru_cache(maxsize = 16)
+def unit_circle(mod) :
+    "returns a tuple of (cos, sin) pairs for the angles qah.circle * i / mod, for" \
+    " i in [0, mod)."
+    return \
+        tuple \
+          (
+            (math.cos(qah.circle * i / mod), math.sin(qah.circle * i / mod))
+            for i in range(mod)
+          )
+#end unit_circle
+
+@functools.lru_cache(maxsize = 64)
+def step_layout(delta, mod) :
+    "returns the sequence of mod angle steps (in units of qah.circle / mod) at which" \
+    " successive points lie on a Maurer rose with the given delta and mod. This does" \
+    " not depend on any of the other curve parameters, so it is cached across frames."
+    return \
+        tuple((n * delta) % mod for n in range(mod))
+#end step_layout
+
 def draw(g, amplitude, delta, mod, freq, offset, phase, start = 0, end = 1) :
     "draws a Maurer rose into the qahirah.Context g. amplitude is the amplitude" \
     " of the sine wave, delta the number of steps between successive curve points" \
@@ -21,33 +41,29 @@ def draw(g, amplitude, delta, mod, freq, offset, phase, start = 0, end = 1) :
     " steps around curve) (the “z” parameter from the Maurer paper), freq the" \
     " “n” parameter from the Maurer paper, offset the offset of the curve from" \
     " the centre, and phase the phase angle for rotating the whole curve."
-
-    k = gcd(delta, mod) # number of points per subcurve
-
-    def subcurve_func(n) :
-        return \
-            n // mod // k
-    #end subcurve_func
-
-    def curve_func(n) :
-        subcurve = n // mod // k
-        step = n * delta % mod
-        phi = qah.circle * (step + subcurve) / mod
-        theta = qah.circle * ((step + subcurve) * freq / mod + phase)
-        r = offset + math.sin(theta) * amplitude
-        return \
-            qah.Vector(r * math.cos(phi), r * math.sin(phi))
-    #end curve_func
-
+    steps = step_layout(delta, mod)
+    circle = unit_circle(mod)
+    # the angles phi and theta of each point are both whole multiples of
+    # qah.circle / mod (apart from the phase), so all the trig can be
+    # looked up in the same table, with sin(theta) expanded as
+    # sin(freq angle) * cos(phase) + cos(freq angle) * sin(phase).
+    phase_cos = math.cos(qah.circle * phase) * amplitude
+    phase_sin = math.sin(qah.circle * phase) * amplitude
+    points = []
+    for step in steps :
+        cos_theta, sin_theta = circle[step * freq % mod]
+        cos_phi, sin_phi = circle[step]
+        r = offset + sin_theta * phase_cos + cos_theta * phase_sin
+        points.append(qah.Vector(r * cos_phi, r * sin_phi))
+    #end for
     common.draw_curve_discrete \
       (
         g = g,
-        f = curve_func,
+        f = points.__getitem__,
         closed = True,
         nr_steps = mod,
         start = start,
-        end = end,
-        subcurve = subcurve_func
+        end = end
       )
 #end draw
 
@@ -0,0 +1,329 @@
+#+
+# Live preview of an animation, served as a stream of frames over HTTP
+# while it plays in real time.
+#
+# Copyright 2026 by Lawrence D'Oliveiro <ldo@geek-central.gen.nz>.
+# Licensed under CC-BY-SA <http://creativecommons.org/licenses/by-sa/4.0/>.
+#-
+
+import sys
+import os
+import io
+import math
+import stat
+import time
+import threading
+import traceback
+import socketserver
+import http.server
+import qahirah as qah
+from qahirah import \
+    CAIRO, \
+    Vector
+from .common import \
+    FrameTimeCalc
+
+class PreviewRequestHandler(http.server.BaseHTTPRequestHandler) :
+    "serves the frames of the PreviewServer as a multipart/x-mixed-replace stream," \
+    " which browsers will display as a continuously-updating image. Each client is" \
+    " always sent the latest frame, so slow clients simply see fewer frames."
+
+    def do_GET(self) :
+        preview = self.server.preview
+        if self.path == "/" :
+            self.send_response(200)
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header \
+              (
+                "Content-Type",
+                "multipart/x-mixed-replace; boundary=%s" % preview.boundary
+              )
+            self.end_headers()
+            seq = 0
+            try :
+                while True :
+                    frame, seq = preview.next_frame(seq)
+                    if frame == None :
+                        break
+                    #end if
+                    self.wfile.write \
+                      (
+                            (
+                                "--%s\r\nContent-Type: image/png\r\nContent-Length: %d\r\n\r\n"
+                            %
+                                (preview.boundary, len(frame))
+                            ).encode()
+                        +
+                            frame
+                        +
+                            b"\r\n"
+                      )
+                    self.wfile.flush()
+                #end while
+            except (BrokenPipeError, ConnectionResetError) :
+                pass
+            #end try
+        else :
+            self.send_error(404)
+        #end if
+    #end do_GET
+
+    def log_message(self, format, *args) :
+        # no logging of individual requests
+        pass
+    #end log_message
+
+#end PreviewRequestHandler
+
+class PreviewHTTPServer(http.server.ThreadingHTTPServer) :
+    daemon_threads = True
+#end PreviewHTTPServer
+
+class PreviewUnixServer(socketserver.ThreadingUnixStreamServer) :
+    daemon_threads = True
+#end PreviewUnixServer
+
+class PreviewServer :
+    "plays an animation in real time at its frame rate, for watching while it is" \
+    " being worked on. dimensions, start_time, end_time, frame_rate, draw_frame," \
+    " overall_presetup and start_frame_nr have the same meanings as for" \
+    " common.render_anim. The animation loops continuously, and the frames are served" \
+    " to any number of clients as a stream of PNG images over HTTP; address is either" \
+    " a (host, port) tuple for a TCP socket, or a string pathname for a Unix socket.\n" \
+    "\n" \
+    "Whenever drawing a frame takes longer than the frame interval, the frames that" \
+    " should have been shown in the meantime are dropped, and the resolution is reduced" \
+    " in steps down to min_scale times the full dimensions; it is raised again once" \
+    " there is enough time to spare. While playback is behind real time, the render" \
+    " time per frame is reported on stderr at most once every report_interval seconds." \
+    " If drawing a frame raises an exception, it is reported on stderr, and clients" \
+    " continue to be sent the last frame that was drawn successfully.\n" \
+    "\n" \
+    "quality can optionally be a common.QualityController, which is preferred over" \
+    " reducing the resolution: the draw procedure is timed through it, and the scale" \
+    " is only reduced when it is already at its minimum quality. Its budget should" \
+    " allow for the time taken to encode each frame, on top of drawing it."
+
+    scales = (1, 3 / 4, 1 / 2, 3 / 8, 1 / 4, 3 / 16, 1 / 8)
+    boundary = "frame"
+    report_interval = 5.0
+
+    def __init__ \
+      (
+        self,
+        dimensions,
+        start_time,
+        end_time,
+        frame_rate,
+        draw_frame,
+        overall_presetup,
+        start_frame_nr,
+        address = ("localhost", 8000),
+        min_scale = 1 / 4,
+        quality = None
+      ) :
+        self.dimensions = Vector.from_tuple(dimensions)
+        self.frame_times = FrameTimeCalc \
+          (
+            start_time = start_time,
+            end_time = end_time,
+            frame_rate = frame_rate,
+            start_frame_nr = start_frame_nr,
+          )
+        self.quality = quality
+        if quality != None :
+            draw_frame = quality.wrap_draw(draw_frame)
+        #end if
+        self.draw_frame = draw_frame
+        self.overall_presetup = overall_presetup
+        self.address = address
+        self.scales = tuple(s for s in self.scales if s >= min_scale)
+        self.scale_index = 0
+        self.surfaces = {} # mapping from scale to (ImageSurface, Context)
+        self.frame_ready = threading.Condition()
+        self.frame = None # latest frame as PNG bytes
+        self.frame_seq = 0 # incremented for each new frame
+        self.running = False
+        self.server = None
+    #end __init__
+
+    def get_surface(self, scale) :
+        "returns the (ImageSurface, Context) to use for drawing at the specified scale."
+        if scale not in self.surfaces :
+            pix = qah.ImageSurface.create \
+              (
+                CAIRO.FORMAT_ARGB32,
+                Vector(max(round(self.dimensions.x * scale), 1), max(round(self.dimensions.y * scale), 1))
+              )
+            g = qah.Context.create(pix)
+            g.scale(scale)
+            if self.overall_presetup != None :
+                self.overall_presetup(g)
+            #end if
+            self.surfaces[scale] = (pix, g)
+        #end if
+        return \
+            self.surfaces[scale]
+    #end get_surface
+
+    def render(self, t) :
+        "draws the frame at time t at the current scale, returning it as PNG bytes."
+        pix, g = self.get_surface(self.scales[self.scale_index])
+        g.save()
+        try :
+            self.draw_frame(g, t)
+        finally :
+            g.restore()
+        #end try
+        pix.flush()
+        out = io.BytesIO()
+        pix.write_to_png_file(out)
+        return \
+            out.getvalue()
+    #end render
+
+    def adjust_scale(self, render_time) :
+        "adjusts the rendering scale according to the time the last frame took."
+        frame_interval = 1 / self.frame_times.frame_rate
+        scale = self.scales[self.scale_index]
+        if render_time > frame_interval :
+            if (
+                    self.scale_index + 1 < len(self.scales)
+                and
+                    (self.quality == None or self.quality.quality <= self.quality.min_quality)
+            ) :
+                self.scale_index += 1
+            #end if
+        elif self.scale_index > 0 :
+            # drawing time is roughly proportional to the number of pixels
+            up_scale = self.scales[self.scale_index - 1]
+            if render_time * (up_scale / scale) ** 2 < 0.8 * frame_interval :
+                self.scale_index -= 1
+            #end if
+        #end if
+    #end adjust_scale
+
+    def play(self) :
+        "the rendering loop, which runs on a separate thread."
+        frame_times = self.frame_times
+        duration = frame_times.end_time - frame_times.start_time
+        frame_interval = 1 / frame_times.frame_rate
+        play_start = time.time()
+        last_report = play_start
+        last_wall_frame = -1
+        dropped = 0
+        last_error = None
+        while self.running :
+            elapsed = time.time() - play_start
+            wall_frame = math.floor(elapsed * frame_times.frame_rate)
+            if wall_frame == last_wall_frame :
+                time.sleep((wall_frame + 1) * frame_interval - elapsed)
+                continue
+            #end if
+            if last_wall_frame >= 0 :
+                dropped += wall_frame - last_wall_frame - 1
+            #end if
+            last_wall_frame = wall_frame
+            frame_nr = frame_times.time_to_frame(elapsed % duration + frame_times.start_time)
+            t = frame_times.frame_to_time(frame_nr)
+            render_start = time.time()
+            try :
+                frame = self.render(t)
+            except Exception :
+                # the scene is probably being edited: report the error, but
+                # only when it changes, and keep serving the last good frame
+                error = traceback.format_exc()
+                if error != last_error :
+                    sys.stderr.write \
+                      (
+                        "{}: preview error drawing frame {}:\n{}".format(sys.argv[0], frame_nr, error)
+                      )
+                    last_error = error
+                #end if
+                continue
+            #end try
+            last_error = None
+            render_time = time.time() - render_start
+            with self.frame_ready :
+                self.frame = frame
+                self.frame_seq += 1
+                self.frame_ready.notify_all()
+            #end with
+            if render_time > frame_interval and time.time() - last_report >= self.report_interval :
+                last_report = time.time()
+                if self.quality != None :
+                    frame_quality = self.quality.frame_quality[t]
+                else :
+                    frame_quality = 1
+                #end if
+                sys.stderr.write \
+                  (
+                    "{}: preview behind: {:.3f}s to render frame {}, {:.3f}s available,"
+                    " scale {:g}, quality {:g}, {} frames dropped\n".format
+                      (
+                        sys.argv[0],
+                        render_time,
+                        frame_nr,
+                        frame_interval,
+                        self.scales[self.scale_index],
+                        frame_quality,
+                        dropped,
+                      )
+                  )
+            #end if
+            self.adjust_scale(render_time)
+        #end while
+        with self.frame_ready :
+            self.frame_ready.notify_all()
+        #end with
+    #end play
+
+    def next_frame(self, seq) :
+        "waits for a frame newer than the one numbered seq, returning a tuple of" \
+        " (PNG bytes, frame seq), or (None, seq) if the server is stopping."
+        with self.frame_ready :
+            while self.running and self.frame_seq <= seq :
+                self.frame_ready.wait()
+            #end while
+            if self.running :
+                result = (self.frame, self.frame_seq)
+            else :
+                result = (None, seq)
+            #end if
+        #end with
+        return \
+            result
+    #end next_frame
+
+    def serve_forever(self) :
+        "starts playback, and serves frames to clients until stop is called."
+        if isinstance(self.address, str) :
+            if os.path.exists(self.address) and stat.S_ISSOCK(os.stat(self.address).st_mode) :
+                os.unlink(self.address) # left over from previous run
+            #end if
+            self.server = PreviewUnixServer(self.address, PreviewRequestHandler)
+        else :
+            self.server = PreviewHTTPServer(self.address, PreviewRequestHandler)
+        #end if
+        self.server.preview = self
+        self.running = True
+        player = threading.Thread(target = self.play, daemon = True)
+        player.start()
+        try :
+            self.server.serve_forever()
+        finally :
+            self.running = False
+            player.join()
+            self.server.server_close()
+            if isinstance(self.address, str) :
+                os.unlink(self.address)
+            #end if
+        #end try
+    #end serve_forever
+
+    def stop(self) :
+        "stops a running serve_forever call; may be called from another thread."
+        self.server.shutdown()
+    #end stop
+
+#end PreviewServer
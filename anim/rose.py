@@ -24,6 +24,12 @@ def draw(g, amplitude, freq, offset, phase, nr_steps, start = 0, end = 1) :
             (r * math.cos(phi), r * math.sin(phi))
     #end curve_func
 
+    if freq.numerator != 0 :
+        symmetry = (freq.numerator, 2 * math.pi * freq.denominator / freq.numerator)
+          # advancing x by 1 / freq.numerator advances theta by a full circle
+    else :
+        symmetry = None # just a circle
+    #end if
     common.draw_curve \
       (
         g = g,
@@ -31,7 +37,8 @@ def draw(g, amplitude, freq, offset, phase, nr_steps, start = 0, end = 1) :
         closed = True,
         nr_steps = nr_steps,
         start = start,
-        end = end
+        end = end,
+        symmetry = symmetry
       )
 #end draw
 
@@ -6,7 +6,16 @@
 # Licensed under CC-BY-SA <http://creativecommons.org/licenses/by-sa/4.0/>.
 #-
 
+import os
 import math
+import struct
+import hashlib
+import mmap
+import ctypes as ct
+import collections
+import collections.abc
+import threading
+import concurrent.futures
 import qahirah as qah
 from qahirah import \
     CAIRO, \
@@ -21,15 +30,37 @@ class Slitscan :
     " a qahirah.Context into which to draw, and the current animation time. Drawing is" \
     " clipped to a single column of pixels corresponding to that time, transformed" \
     " to the bounding rectangle with corners at (0, 0) and (1, extent). The image will" \
-    " be animated such that a width of steps pixels occupies duration units of time."
+    " be animated such that a width of steps pixels occupies duration units of time.\n" \
+    "\n" \
+    "If nr_workers is not None, then whenever more than one column needs drawing," \
+    " the columns are divided among up to that many threads, each drawing into its" \
+    " own surface. This is only valid if draw is a pure function of time that is" \
+    " safe to call from multiple threads at once. Use prerender to bring the image" \
+    " up to date for a given time ahead of calling render.\n" \
+    "\n" \
+    "format is the CAIRO.FORMAT_xxx pixel format of the image. FORMAT_RGB24 or" \
+    " FORMAT_RGB16_565 (half the memory) can be used if the image is opaque. With" \
+    " FORMAT_A8 (a quarter of the memory), only coverage is recorded, and when the" \
+    " image is rendered, it is used as a mask for filling with the specified colour" \
+    " (a qahirah.Colour); in this case, background should be a Colour whose alpha" \
+    " gives the initial coverage (usually transparent). If backing_file is not" \
+    " None, it is the name of a file to be created (or reused) and memory-mapped" \
+    " to hold the image pixels, instead of allocating them in memory."
 
 #+
 # Internal stuff
 #-
 
+    def time_to_step(self, at_time) :
+        "returns the column offset for at_time, not reduced modulo steps; offsets" \
+        " decrease as time increases."
+        return \
+            round((1.0 - at_time / self.duration) * self.steps - 1)
+    #end time_to_step
+
     def time_to_offset(self, at_time) :
         return \
-            round((1.0 - at_time / self.duration) * self.steps - 1) % self.steps
+            self.time_to_step(at_time) % self.steps
     #end time_to_offset
 
     def init_background(self) :
@@ -40,32 +71,244 @@ class Slitscan :
         self.g.set_operator(prevop)
     #end init_background
 
+    warp_tolerance = 0.5
+      # maximum deviation, in destination pixels, of the rendered image from
+      # the exact perspective mapping
+
+    @staticmethod
+    def warp_extent(x, span, from_extent, to_extent) :
+        "extent of the rendered image at distance x along a trajectory of length span."
+        return \
+            x / span * (to_extent - from_extent) + from_extent
+    #end warp_extent
+
+    def warp_offset(self, x, span, from_extent, to_extent) :
+        "offset in pixel steps into the source image (relative to the current time)" \
+        " corresponding to distance x along a trajectory of length span. This" \
+        " is (1 / extent - 1 / from_extent) / (1 / to_extent - 1 / from_extent)" \
+        " scaled to steps, i.e. uses reciprocals to simulate perspective" \
+        " foreshortening, rearranged so it still works if from_extent = to_extent."
+        return \
+            (
+                x / span * to_extent
+            /
+                self.warp_extent(x, span, from_extent, to_extent)
+            *
+                self.steps
+            )
+    #end warp_offset
+
+    def warp_bands(self, span, from_extent, to_extent) :
+        "generates successive (start, end) distance ranges along a trajectory of" \
+        " length span, within each of which the perspective mapping can be" \
+        " approximated by an affine one to within warp_tolerance. This is done" \
+        " because Cairo patterns only allow affine transformations, so the image" \
+        " has to be rendered piecewise, but there is no need to render each column" \
+        " of pixels separately."
+        tolerance = self.warp_tolerance
+        extent_change = abs(to_extent - from_extent)
+        band_start = 0
+        while band_start < span :
+            band_end = min(band_start + 1, span)
+            while band_end < span :
+                next_end = min(band_end + 1, span)
+                start_extent = self.warp_extent(band_start, span, from_extent, to_extent)
+                end_extent = self.warp_extent(next_end, span, from_extent, to_extent)
+                min_extent = min(start_extent, end_extent)
+                max_extent = max(start_extent, end_extent)
+                width = next_end - band_start
+                if (
+                        abs(end_extent - start_extent) > 4 * tolerance
+                          # vertical scale taken from middle of band
+                    or
+                            width ** 2 / 4 * extent_change * max_extent ** 2
+                        >
+                            tolerance * span * min_extent ** 3
+                          # bound on error of chord approximation to offset mapping
+                ) :
+                    break
+                #end if
+                band_end = next_end
+            #end while
+            yield band_start, band_end
+            band_start = band_end
+        #end while
+    #end warp_bands
+
+    def column_context(self, offset, g = None) :
+        "returns a graphics context for drawing the column of pixels at the" \
+        " specified offset, without clearing it first. g defaults to the context" \
+        " for the slitscan image itself."
+        if g == None :
+            g = self.g
+        #end if
+        g.identity_matrix()
+        g.reset_clip()
+        g.new_path()
+        g.translate((offset, 0))
+        g.rectangle(Rect(0, 0, 1, self.extent))
+        g.clip()
+        g.new_path()
+        return \
+            g
+    #end column_context
+
     def get_context(self, at_time) :
         "returns a graphics context for drawing the current row/column of pixels." \
         " at_time is in units such that 1.0 corresponds to the full number" \
         " of pixel steps in the pattern."
-        self.g.identity_matrix()
-        self.g.reset_clip()
-        self.g.new_path()
-        self.g.translate((self.time_to_offset(at_time), 0))
-        self.g.rectangle(Rect(0, 0, 1, self.extent))
-        self.g.clip()
-        self.g.new_path()
+        self.column_context(self.time_to_offset(at_time))
         self.init_background()
         return \
             self.g
     #end get_context
 
+    def clear_columns(self, from_step, to_step) :
+        "fills the columns at offsets [from_step, to_step) (not reduced modulo steps," \
+        " and covering at most steps columns) with the background colour, in one" \
+        " operation."
+        self.g.identity_matrix()
+        self.g.reset_clip()
+        self.g.new_path()
+        left = from_step % self.steps
+        width = to_step - from_step
+        self.g.rectangle(Rect(left, 0, min(width, self.steps - left), self.extent))
+        if left + width > self.steps :
+            # wraps around
+            self.g.rectangle(Rect(0, 0, left + width - self.steps, self.extent))
+        #end if
+        prevop = self.g.operator
+        self.g.set_operator(CAIRO.OPERATOR_SOURCE)
+        self.g.set_source_colour(self.background)
+        self.g.fill()
+        self.g.set_operator(prevop)
+    #end clear_columns
+
+    def catch_up(self, at_time) :
+        "draws all the columns needed to bring the image up to date for at_time." \
+        " Only columns which are not already valid are drawn, and no more than" \
+        " steps of them, no matter how far time has jumped, in either direction."
+        if self.last_draw_time == None :
+            self.last_draw_time = - self.duration / self.steps
+        #end if
+        at_step = self.time_to_step(at_time)
+        last_step = self.time_to_step(self.last_draw_time)
+        # image shows columns at offsets [at_step, at_step + steps), of which
+        # [last_step, last_step + steps) are already valid.
+        if at_step < last_step :
+            # time has moved forward
+            from_step = at_step
+            to_step = min(last_step, at_step + self.steps)
+            anchor_time, anchor_step = self.last_draw_time, last_step
+        elif at_step > last_step :
+            # time has moved backward
+            from_step = max(at_step, last_step + self.steps)
+            to_step = at_step + self.steps
+            anchor_time, anchor_step = at_time, at_step
+        else :
+            from_step = to_step = at_step
+        #end if
+        column_time = lambda step : anchor_time + (anchor_step - step) * self.duration / self.steps
+        if to_step - from_step > 1 and self.nr_workers != None :
+            self.draw_columns_parallel(from_step, to_step, column_time)
+        elif to_step > from_step :
+            self.clear_columns(from_step, to_step)
+            for this_step in range(to_step - 1, from_step - 1, -1) :
+                # in order of increasing time
+                self.draw(self.column_context(this_step % self.steps), column_time(this_step))
+            #end for
+        #end if
+        self.last_draw_time = at_time
+    #end catch_up
+
+    def draw_columns_parallel(self, from_step, to_step, column_time) :
+        "draws the columns at offsets [from_step, to_step) (not reduced modulo steps)" \
+        " by dividing them into contiguous runs, each drawn by a separate worker" \
+        " thread into its own surface, which are then copied into the image."
+
+        def draw_run(run_start, run_end) :
+            pix = qah.ImageSurface.create(self.pix.format, (run_end - run_start, self.extent))
+            g = qah.Context.create(pix)
+            g.set_operator(CAIRO.OPERATOR_SOURCE)
+            g.set_source_colour(self.background)
+            g.paint()
+            g.set_operator(CAIRO.OPERATOR_OVER)
+            for this_step in range(run_end - 1, run_start - 1, -1) :
+                self.draw(self.column_context(this_step - run_start, g), column_time(this_step))
+            #end for
+            pix.flush()
+            return \
+                pix
+        #end draw_run
+
+    #begin draw_columns_parallel
+        nr_runs = min(self.nr_workers, to_step - from_step)
+        run_steps = tuple \
+          (
+            from_step + (to_step - from_step) * i // nr_runs
+            for i in range(nr_runs + 1)
+          )
+        with concurrent.futures.ThreadPoolExecutor(max_workers = nr_runs) as workers :
+            runs = list \
+              (
+                (run_start, workers.submit(draw_run, run_start, run_end))
+                for run_start, run_end in zip(run_steps[:-1], run_steps[1:])
+              )
+            self.g.identity_matrix()
+            self.g.reset_clip()
+            prevop = self.g.operator
+            self.g.set_operator(CAIRO.OPERATOR_SOURCE)
+            for run_start, run in runs :
+                pix = run.result()
+                left = run_start % self.steps
+                for x in (left, left - self.steps) :
+                    # allow for wraparound
+                    if x + pix.width > 0 :
+                        self.g.set_source_surface(pix, (x, 0))
+                        self.g.new_path()
+                        self.g.rectangle(Rect(x, 0, pix.width, self.extent))
+                        self.g.fill()
+                    #end if
+                #end for
+            #end for
+            self.g.set_operator(prevop)
+        #end with
+    #end draw_columns_parallel
+
 #+
 # User-visible stuff
 #-
 
-    def __init__(self, draw, extent, steps, duration, background) :
+    def __init__ \
+      (
+        self, draw, extent, steps, duration, background, nr_workers = None,
+        format = CAIRO.FORMAT_ARGB32, colour = None, backing_file = None
+      ) :
         self.draw = draw
+        self.nr_workers = nr_workers
         self.extent = extent
         self.steps = steps
         self.duration = duration
-        self.pix = qah.ImageSurface.create(CAIRO.FORMAT_ARGB32, (steps, extent))
+        if format == CAIRO.FORMAT_A8 and colour == None :
+            raise ValueError("need colour for FORMAT_A8 image")
+        #end if
+        self.colour = colour
+        if backing_file != None :
+            stride = qah.ImageSurface.format_stride_for_width(format, steps)
+            nr_bytes = stride * extent
+            with open(backing_file, "a+b") as backing :
+                backing.truncate(nr_bytes)
+                self.backing = mmap.mmap(backing.fileno(), nr_bytes)
+            #end with
+            self.backing_data = (ct.c_ubyte * nr_bytes).from_buffer(self.backing)
+            self.pix = qah.ImageSurface.create_for_data \
+              (
+                ct.addressof(self.backing_data), format, (steps, extent), stride
+              )
+        else :
+            self.backing = None
+            self.pix = qah.ImageSurface.create(format, (steps, extent))
+        #end if
         self.background = background
         self.g = qah.Context.create(self.pix)
         self.pat = qah.Pattern.create_for_surface(self.pix)
@@ -75,6 +318,15 @@ class Slitscan :
         self.last_draw_time = None
     #end __init__
 
+    def prerender(self, at_time) :
+        "draws all the columns of the image that need updating for at_time, so" \
+        " that a subsequent render call for the same time only needs to do the" \
+        " final perspective drawing."
+        if self.last_draw_time != at_time :
+            self.catch_up(at_time)
+        #end if
+    #end prerender
+
     def render(self, g, at_time, from_pos, from_extent, to_pos, to_extent) :
         "updates the current state of the pattern and draws it into destination qahirah.Context" \
         " g. The line from Vectors from_pos to to_pos defines the starting and ending" \
@@ -84,23 +336,7 @@ class Slitscan :
         from_pos = Vector.from_tuple(from_pos)
         to_pos = Vector.from_tuple(to_pos)
         base_offset = self.time_to_offset(at_time)
-        if self.last_draw_time != at_time :
-            if self.last_draw_time == None :
-                self.last_draw_time = - self.duration / self.steps
-            #end if
-            this_offset = self.time_to_offset(self.last_draw_time)
-            time_steps = 0
-            while this_offset != base_offset :
-                time_steps += 1
-                this_offset -= 1
-                if this_offset < 0 :
-                    this_offset += self.steps
-                #end if
-                this_time = self.last_draw_time + time_steps * self.duration / self.steps
-                self.draw(self.get_context(this_time), this_time)
-            #end while
-            self.last_draw_time = at_time
-        #end if
+        self.prerender(at_time)
         angle = (to_pos - from_pos).angle()
         self.pix.flush()
         g.save()
@@ -108,74 +344,131 @@ class Slitscan :
         g.rotate(angle) # orient source pattern parallel to x-axis
         g.translate(- from_pos)
         span = abs(to_pos - from_pos)
-        for i in range(0, math.ceil(span)) :
-            dst_width = min(span - i, 1)
-            dst_extent = i / span * (to_extent - from_extent) + from_extent
-            dst_extent2 = (i + dst_width) / span * (to_extent - from_extent) + from_extent
-            # conversion from coords in destination image to offsets in source image
-            # uses reciprocals to simulate perspective foreshortening. Note offsets
-            # are from base_offset - 1, not base_offset, because column of pixels
-            # drawn at time t = 0 is at far right (x = steps - 1).
-            this_offset = \
-                (
-                    (
-                            (1 / dst_extent - 1 / from_extent)
-                        /
-                            (1 / to_extent - 1 / from_extent)
-                        *
-                            self.steps
-                    +
-                        base_offset
-                    -
-                        1
-                    )
-                %
-                    self.steps
-                )
-            this_offset2 = \
-                (
-                    (
-                            (1 / dst_extent2 - 1 / from_extent)
-                        /
-                            (1 / to_extent - 1 / from_extent)
-                        *
-                            self.steps
-                    +
-                        base_offset
-                    -
-                        1
-                    )
-                %
-                    self.steps
-                )
-            if this_offset2 < this_offset :
-                this_offset2 += self.steps
-            #end if
-            dst_x = from_pos.x + i
-            src_rect = Rect(this_offset, 0, this_offset2 - this_offset, self.extent)
-            dst_rect = Rect(dst_x, from_pos.y - dst_extent / 2, dst_width, dst_extent)
+        for band_start, band_end in self.warp_bands(span, from_extent, to_extent) :
+            dst_extent = self.warp_extent(band_start, span, from_extent, to_extent)
+            dst_extent2 = self.warp_extent(band_end, span, from_extent, to_extent)
+            # Note offsets are from base_offset - 1, not base_offset, because column
+            # of pixels drawn at time t = 0 is at far right (x = steps - 1). Offsets
+            # are not reduced modulo steps, since the pattern repeats anyway.
+            this_offset = self.warp_offset(band_start, span, from_extent, to_extent) + base_offset - 1
+            this_offset2 = self.warp_offset(band_end, span, from_extent, to_extent) + base_offset - 1
+            dst_x = from_pos.x + band_start
+            dst_x2 = from_pos.x + band_end
+            mid_extent = (dst_extent + dst_extent2) / 2
+            src_rect = Rect(this_offset % self.steps, 0, this_offset2 - this_offset, self.extent)
+            dst_rect = Rect(dst_x, from_pos.y - mid_extent / 2, dst_x2 - dst_x, mid_extent)
             self.pat.matrix = dst_rect.transform_to(src_rect)
-            g.set_source(self.pat)
             g.new_path()
-            g.rectangle(dst_rect)
-            g.fill()
+            g.move_to((dst_x, from_pos.y - dst_extent / 2))
+            g.line_to((dst_x2, from_pos.y - dst_extent2 / 2))
+            g.line_to((dst_x2, from_pos.y + dst_extent2 / 2))
+            g.line_to((dst_x, from_pos.y + dst_extent / 2))
+            g.close_path()
+            if self.colour != None :
+                # image is only a mask
+                g.save()
+                g.clip()
+                g.set_source_colour(self.colour)
+                g.mask(self.pat)
+                g.restore()
+            else :
+                g.set_source(self.pat)
+                g.fill()
+            #end if
         #end for
         g.restore()
     #end render
 
+    checkpoint_header = struct.Struct("<4sIIIIIdd")
+      # magic, version, pixel format, width (steps), height (extent), stride,
+      # duration, last_draw_time (NaN for None)
+    checkpoint_magic = b"SLIT"
+    checkpoint_version = 1
+    checkpoint_data_offset = 64 # header is padded to this size
+
+    def save_checkpoint(self, filename) :
+        "saves the current state of the image, and the time it is up to date for," \
+        " to the specified file, so it can later be restored with restore_checkpoint." \
+        " The pixels are saved uncompressed, so they can be memory-mapped on restore."
+        self.pix.flush()
+        header = self.checkpoint_header.pack \
+          (
+            self.checkpoint_magic,
+            self.checkpoint_version,
+            self.pix.format,
+            self.pix.width,
+            self.pix.height,
+            self.pix.stride,
+            self.duration,
+            (self.last_draw_time, math.nan)[self.last_draw_time == None]
+          )
+        with open(filename, "wb") as outfile :
+            outfile.write(header)
+            outfile.write(bytes(self.checkpoint_data_offset - len(header)))
+            outfile.write(ct.string_at(self.pix.data, self.pix.stride * self.pix.height))
+        #end with
+    #end save_checkpoint
+
+    def restore_checkpoint(self, filename) :
+        "restores the state of the image from a file previously written by" \
+        " save_checkpoint, from a Slitscan with the same extent, steps and duration." \
+        " Rendering can then continue from that time without having to redraw" \
+        " all the columns leading up to it."
+        with open(filename, "rb") as infile :
+            header = self.checkpoint_header.unpack(infile.read(self.checkpoint_header.size))
+            magic, version, format, width, height, stride, duration, last_draw_time = header
+            if magic != self.checkpoint_magic or version != self.checkpoint_version :
+                raise ValueError("not a Slitscan checkpoint file: %s" % filename)
+            #end if
+            if (
+                    (format, width, height, stride, duration)
+                !=
+                    (self.pix.format, self.pix.width, self.pix.height, self.pix.stride, self.duration)
+            ) :
+                raise ValueError("checkpoint does not match this Slitscan: %s" % filename)
+            #end if
+            nr_bytes = stride * height
+            data = mmap.mmap(infile.fileno(), 0, access = mmap.ACCESS_COPY)
+            try :
+                if len(data) < self.checkpoint_data_offset + nr_bytes :
+                    raise ValueError("checkpoint file is truncated: %s" % filename)
+                #end if
+                self.pix.flush()
+                src = (ct.c_ubyte * nr_bytes).from_buffer(data, self.checkpoint_data_offset)
+                ct.memmove(self.pix.data, src, nr_bytes)
+                del src # release reference to mmap buffer
+            finally :
+                data.close()
+            #end try
+        #end with
+        self.pix.mark_dirty()
+        self.last_draw_time = (last_draw_time, None)[math.isnan(last_draw_time)]
+    #end restore_checkpoint
+
 #end Slitscan
 
 class SlitscanObjects(Slitscan) :
     "draws a series of static objects arranged in time and space. items is a sequence of Item," \
     " (see the inner class definition) in the order in which they are to be drawn (which" \
-    " need not correspond to their ordering in time); extent, steps, duration and background" \
-    " have the same meanings as for the Slitscan superclass."
+    " need not correspond to their ordering in time). Alternatively, items can be an" \
+    " iterator yielding Items in order of x_offset, which can be unbounded; in this case," \
+    " Items are only pulled from it as the columns being drawn approach them, and are" \
+    " dropped once drawing has passed them, so the animation time must only move" \
+    " forward. extent, steps, duration and background" \
+    " have the same meanings as for the Slitscan superclass. cache_limit is the maximum" \
+    " number of bytes to use for caching item images (loaded and downscaled to the size" \
+    " at which they are drawn). If prefetch_time is not None, then images for items" \
+    " coming up within that much time of the columns being drawn are loaded ahead of" \
+    " time on a background thread; in this case, close should be called when finished" \
+    " with the SlitscanObjects, to shut down that thread."
 
     class Item :
-        "surface is expected to be a qahirah.ImageSurface, while the other parameters specify" \
-        " its extent in space and time within the slitscan animation: width and x_offset" \
-        " are in time units, while height and y_offset are in units of the height of the" \
-        " slit."
+        "surface is expected to be a qahirah.ImageSurface, or the name of a PNG file," \
+        " or a function of no arguments returning a qahirah.ImageSurface; in the latter" \
+        " two cases, the image is only loaded when it is needed. The other parameters" \
+        " specify its extent in space and time within the slitscan animation: width" \
+        " and x_offset are in time units, while height and y_offset are in units of" \
+        " the height of the slit."
 
         def __init__(self, surface, width, height, x_offset, y_offset) :
             self.surface = surface
@@ -185,40 +478,315 @@ class SlitscanObjects(Slitscan) :
             self.y_offset = y_offset
         #end __init__
 
+        def load_surface(self) :
+            "returns the qahirah.ImageSurface for this Item, loading it if necessary." \
+            " The result is not kept; caching is up to the caller."
+            if isinstance(self.surface, qah.ImageSurface) :
+                surface = self.surface
+            elif isinstance(self.surface, str) :
+                surface = qah.ImageSurface.create_from_png(self.surface)
+            else :
+                surface = self.surface()
+            #end if
+            return \
+                surface
+        #end load_surface
+
     #end Item
 
-    def draw_items(self, g, t) :
-        for item in self.items :
-            if (
-                    item.x_offset >= t and item.x_offset <= t + self.duration
-                or
-                        item.x_offset + item.width >= t
+    index_bucket_width = 1 / 16
+      # width of each time bucket in the item index, as a fraction of duration
+
+    def index_buckets(self, from_time, to_time) :
+        "returns the range of item index buckets covering the time range" \
+        " [from_time, to_time]."
+        bucket_width = self.index_bucket_width * self.duration
+        return \
+            range(math.floor(from_time / bucket_width), math.floor(to_time / bucket_width) + 1)
+    #end index_buckets
+
+    def visible_items(self, from_time, to_time) :
+        "returns the list of Items overlapping the time range [from_time, to_time]," \
+        " in drawing order."
+        candidates = {}
+        for bucket in self.index_buckets(from_time, to_time) :
+            for seq, item in self.item_index.get(bucket, ()) :
+                if item.x_offset <= to_time and item.x_offset + item.width >= from_time :
+                    candidates[seq] = item
+                #end if
+            #end for
+        #end for
+        return \
+            list(candidates[seq] for seq in sorted(candidates))
+    #end visible_items
+
+    def item_dimensions(self, item) :
+        "returns the dimensions in pixels occupied by item in the slitscan image."
+        return \
+            Vector(item.width / self.duration * self.steps, item.height * self.extent)
+    #end item_dimensions
+
+    def make_scaled_surface(self, item, dimensions) :
+        "loads the image for item, downscaling it to dimensions if it is larger."
+        surface = item.load_surface()
+        if dimensions.x < surface.width or dimensions.y < surface.height :
+            dimensions = Vector(min(dimensions.x, surface.width), min(dimensions.y, surface.height))
+            scaled = qah.ImageSurface.create(CAIRO.FORMAT_ARGB32, dimensions)
+            g = qah.Context.create(scaled)
+            g.scale((dimensions.x / surface.width, dimensions.y / surface.height))
+            g.set_source_surface(surface, (0, 0))
+            g.source.set_filter(CAIRO.FILTER_GOOD)
+            g.set_operator(CAIRO.OPERATOR_SOURCE)
+            g.paint()
+            scaled.flush()
+            surface = scaled
+        #end if
+        return \
+            surface
+    #end make_scaled_surface
+
+    def insert_surface(self, key, surface) :
+        # adds surface to the image cache, discarding the least recently used
+        # entries as necessary to stay within cache_limit. Must be called with
+        # cache_lock held.
+        if key not in self.scaled_cache :
+            self.scaled_cache[key] = surface
+            self.scaled_cache_size += surface.stride * surface.height
+            while self.scaled_cache_size > self.cache_limit and len(self.scaled_cache) > 1 :
+                _, discard = self.scaled_cache.popitem(last = False)
+                self.scaled_cache_size -= discard.stride * discard.height
+            #end while
+        #end if
+    #end insert_surface
+
+    def cache_surface(self, key, surface) :
+        "adds surface to the image cache, discarding the least recently used" \
+        " entries as necessary to stay within cache_limit."
+        with self.cache_lock :
+            self.insert_surface(key, surface)
+        #end with
+    #end cache_surface
+
+    def evict_item(self, item) :
+        "discards all cached images for item, and cancels any pending prefetches" \
+        " of it, so nothing refers to it any more."
+        with self.cache_lock :
+            for key in list(k for k in self.scaled_cache if k[0] == id(item)) :
+                discard = self.scaled_cache.pop(key)
+                self.scaled_cache_size -= discard.stride * discard.height
+            #end for
+            for key in list(k for k in self.prefetching if k[0] == id(item)) :
+                self.prefetching.pop(key).cancel()
+            #end for
+        #end with
+    #end evict_item
+
+    def scaled_key(self, item) :
+        "returns the image cache key for item. This uses the id of the item rather" \
+        " than the item itself, so the cache does not keep items (and any full-size" \
+        " images they hold) alive; evict_item must be called for items that are" \
+        " dropped, since their ids can then be reused."
+        dimensions = self.item_dimensions(item)
+        return \
+            (id(item), max(math.ceil(dimensions.x), 1), max(math.ceil(dimensions.y), 1))
+    #end scaled_key
+
+    def scaled_surface(self, item) :
+        "returns the image for item, loaded if necessary, and downscaled to the size" \
+        " at which it will be drawn, so it does not have to be resampled from full" \
+        " resolution for every column. Results are cached, up to a total of" \
+        " cache_limit bytes, discarding the least recently used ones as necessary." \
+        " Surfaces supplied directly to the Item which do not need downscaling are" \
+        " returned as is, and do not count against the cache."
+        key = self.scaled_key(item)
+        with self.cache_lock :
+            surface = self.scaled_cache.get(key)
+            if surface != None :
+                self.scaled_cache.move_to_end(key)
+            #end if
+            pending = self.prefetching.get(key)
+        #end with
+        if surface == None :
+            if pending != None :
+                surface = pending.result()
+            else :
+                surface = self.make_scaled_surface(item, Vector(key[1], key[2]))
+                if surface is not item.surface :
+                    self.cache_surface(key, surface)
+                #end if
+            #end if
+        #end if
+        return \
+            surface
+    #end scaled_surface
+
+    def prefetch_item(self, item, key) :
+        # runs on background thread to load an image ahead of time.
+        surface = None
+        try :
+            surface = self.make_scaled_surface(item, Vector(key[1], key[2]))
+        finally :
+            with self.cache_lock :
+                # only cache if item has not been evicted in the meantime
+                if (
+                        self.prefetching.pop(key, None) != None
                     and
-                        item.x_offset + item.width <= t + self.duration
-                  # either left or right edge is visible <=> some part of image is visible
-            ) :
-                g.save()
-                g.translate \
-                  ((
-                    (item.x_offset - t) / self.duration * self.steps, item.y_offset * self.extent
-                  ))
-                g.scale \
-                  ((
-                    item.width / self.duration * self.steps / item.surface.width,
-                    item.height * self.extent / item.surface.height
-                  ))
-                g.set_source_surface(item.surface, (0, 0))
-                g.paint()
-                g.restore()
+                        surface != None
+                    and
+                        surface is not item.surface
+                ) :
+                    self.insert_surface(key, surface)
+                #end if
+            #end with
+        #end try
+        return \
+            surface
+    #end prefetch_item
+
+    def prefetch(self, t) :
+        "starts background loading of images for items coming up within" \
+        " prefetch_time of t."
+        for item in self.visible_items(t, t + self.prefetch_time) :
+            key = self.scaled_key(item)
+            with self.cache_lock :
+                if (
+                        self.prefetcher != None # not closed meanwhile
+                    and
+                        key not in self.scaled_cache
+                    and
+                        key not in self.prefetching
+                ) :
+                    self.prefetching[key] = self.prefetcher.submit(self.prefetch_item, item, key)
+                #end if
+            #end with
+        #end for
+    #end prefetch
+
+    def stream_items(self, t) :
+        "pulls in items from item_source which might be visible up to the end" \
+        " of the index bucket containing t (plus prefetch_time), and drops" \
+        " items in buckets before t, along with their cached images."
+        bucket = self.index_buckets(t, t)[0]
+        to_time = (bucket + 1) * self.index_bucket_width * self.duration + self.duration / self.steps
+        if self.prefetch_time != None :
+            to_time += self.prefetch_time
+        #end if
+        while True :
+            if self.next_item == None :
+                try :
+                    self.next_item = next(self.item_source)
+                except StopIteration :
+                    self.item_source = None
+                    break
+                #end try
+            #end if
+            if self.next_item.x_offset > to_time :
+                break
             #end if
+            self.add_item(self.next_item)
+            self.next_item = None
+        #end while
+        dropped = {}
+        for old_bucket in list(b for b in self.item_index if b < bucket) :
+            dropped.update(self.item_index.pop(old_bucket))
+        #end for
+        for items in self.item_index.values() :
+            for seq, item in items :
+                dropped.pop(seq, None) # still indexed in a later bucket
+            #end for
+        #end for
+        for item in dropped.values() :
+            self.evict_item(item)
+        #end for
+    #end stream_items
+
+    def draw_items(self, g, t) :
+        bucket = self.index_buckets(t, t)[0]
+        if bucket != self.last_bucket :
+            self.last_bucket = bucket
+            if self.item_source != None :
+                self.stream_items(t)
+            #end if
+            if self.prefetcher != None :
+                self.prefetch(t)
+            #end if
+        #end if
+        for item in self.visible_items(t, t + self.duration / self.steps) :
+            surface = self.scaled_surface(item)
+            dimensions = self.item_dimensions(item)
+            g.save()
+            g.translate \
+              ((
+                (item.x_offset - t) / self.duration * self.steps, item.y_offset * self.extent
+              ))
+            g.scale \
+              ((
+                dimensions.x / surface.width,
+                dimensions.y / surface.height
+              ))
+            g.set_source_surface(surface, (0, 0))
+            g.paint()
+            g.restore()
         #end for
     #end draw_items
 
-    def __init__(self, items, extent, steps, duration, background) :
-        self.items = items
+    def __init__(self, items, extent, steps, duration, background, cache_limit = 256 * 1024 * 1024, prefetch_time = None) :
+        self.cache_limit = cache_limit
+        self.scaled_cache = collections.OrderedDict()
+          # mapping from (item, width, height) to loaded/downscaled surface, in LRU order
+        self.scaled_cache_size = 0
+        self.cache_lock = threading.Lock()
+        self.prefetch_time = prefetch_time
+        self.prefetching = {} # mapping from cache key to Future for images being loaded
+        self.last_bucket = None # index bucket for last column drawn
+        if prefetch_time != None :
+            self.prefetcher = concurrent.futures.ThreadPoolExecutor(max_workers = 1)
+        else :
+            self.prefetcher = None
+        #end if
+        self.nr_items = 0
+        self.item_index = {}
+          # mapping from time bucket number to list of (seq, item) for all items
+          # overlapping that bucket, where seq is the drawing order
         super().__init__(self.draw_items, extent, steps, duration, background)
+        self.next_item = None
+        if isinstance(items, collections.abc.Iterator) :
+            self.item_source = items
+        else :
+            self.item_source = None
+            for item in items :
+                self.add_item(item)
+            #end for
+        #end if
     #end __init__
 
+    def add_item(self, item) :
+        "adds another Item, to be drawn after all the existing ones. Note this will" \
+        " not affect any parts of the image that have already been drawn."
+        seq = self.nr_items
+        self.nr_items += 1
+        for bucket in self.index_buckets(item.x_offset, item.x_offset + item.width) :
+            self.item_index.setdefault(bucket, []).append((seq, item))
+        #end for
+    #end add_item
+
+    def close(self) :
+        "stops background prefetching, cancelling any queued prefetches and waiting" \
+        " for one in progress to finish. Drawing can continue afterwards, but there" \
+        " will be no more prefetching."
+        with self.cache_lock :
+            prefetcher = self.prefetcher
+            self.prefetcher = None
+            for pending in self.prefetching.values() :
+                pending.cancel()
+            #end for
+            self.prefetching.clear()
+        #end with
+        if prefetcher != None :
+            prefetcher.shutdown() # outside lock, since a running prefetch needs it
+        #end if
+    #end close
+
 #end SlitscanObjects
 
 def make_draw(slitscan, from_pos, from_extent, to_pos, to_extent) :
@@ -268,24 +836,211 @@ def make_static_draw(*draw_settings) :
     ) :
         draw_settings = draw_settings[0]
     #end if
+    apply_settings.draw_settings = draw_settings # for ImageCache
     return \
         apply_settings
 #end make_static_draw
 
-def make_image(dimensions, draw) :
+class ImageCache :
+    "a disk cache for images constructed by make_image from draw procedures returned" \
+    " by make_static_draw. Images are stored in directory as files named by a hash" \
+    " of their dimensions and draw settings, in an uncompressed form that is quick" \
+    " to load. When the total size exceeds max_bytes, the least recently used files" \
+    " are deleted. Draw settings containing objects for which no representation" \
+    " can be computed that is stable across runs are not cached."
+
+    header = struct.Struct("<4sIIII")
+      # magic, version, width, height, stride
+    magic = b"IMGC"
+    version = 1
+
+    def __init__(self, directory, max_bytes = 1024 * 1024 * 1024) :
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok = True)
+    #end __init__
+
+    @classmethod
+    def describe(celf, obj) :
+        "returns a string representation of obj that is stable across runs, or" \
+        " None if there is none. Handles basic Python types and sequences, and" \
+        " objects (like qahirah.Vector, Colour and Matrix) whose state is entirely" \
+        " held in their __slots__; objects wrapping Cairo or other ctypes handles" \
+        " are not describable."
+        if obj == None or isinstance(obj, (bool, int, float, str, bytes)) :
+            result = repr(obj)
+        else :
+            if isinstance(obj, (tuple, list)) :
+                elts = obj
+            elif hasattr(obj, "_cairobj") or isinstance(obj, (ct._SimpleCData, ct._Pointer, ct.Structure, ct.Union, ct.Array)) :
+                # state is held outside Python, e.g. qahirah.ImageSurface, which has
+                # empty __slots__ but different contents for every instance
+                elts = None
+            else :
+                slots = []
+                for cls in type(obj).__mro__ :
+                    cls_slots = cls.__dict__.get("__slots__", ())
+                    if isinstance(cls_slots, str) :
+                        cls_slots = (cls_slots,)
+                    #end if
+                    slots.extend(name for name in cls_slots if name not in slots)
+                #end for
+                if len(slots) != 0 :
+                    elts = tuple(getattr(obj, name, None) for name in slots)
+                else :
+                    elts = None # no way of telling instances apart
+                #end if
+            #end if
+            if elts != None :
+                elts = tuple(celf.describe(elt) for elt in elts)
+                if None in elts :
+                    result = None
+                else :
+                    result = "%s(%s)" % (type(obj).__name__, ", ".join(elts))
+                #end if
+            else :
+                result = None
+            #end if
+        #end if
+        return \
+            result
+    #end describe
+
+    def key(self, dimensions, draw) :
+        "returns the cache key for an image of the specified dimensions made by" \
+        " draw, or None if it cannot be cached."
+        settings = getattr(draw, "draw_settings", None)
+        if settings != None :
+            dimensions = Vector.from_tuple(dimensions)
+            desc = self.describe((self.version, dimensions.x, dimensions.y, settings))
+        else :
+            desc = None
+        #end if
+        if desc != None :
+            result = hashlib.sha256(desc.encode()).hexdigest()
+        else :
+            result = None
+        #end if
+        return \
+            result
+    #end key
+
+    def filename(self, key) :
+        return \
+            os.path.join(self.directory, key + ".img")
+    #end filename
+
+    def load(self, key) :
+        "returns the cached qahirah.ImageSurface for key, or None if not present."
+        try :
+            with open(self.filename(key), "rb") as infile :
+                header = infile.read(self.header.size)
+                data = infile.read()
+            #end with
+        except FileNotFoundError :
+            header = None
+        #end try
+        result = None
+        if header != None and len(header) == self.header.size :
+            magic, version, width, height, stride = self.header.unpack(header)
+            if magic == self.magic and version == self.version and len(data) == stride * height :
+                result = qah.ImageSurface.create(CAIRO.FORMAT_ARGB32, (width, height))
+                if result.stride == stride :
+                    result.flush()
+                    ct.memmove(result.data, data, len(data))
+                    result.mark_dirty()
+                    try :
+                        os.utime(self.filename(key)) # mark as recently used
+                    except FileNotFoundError :
+                        pass # evicted by another process meanwhile, still have the image
+                    #end try
+                else :
+                    result = None
+                #end if
+            #end if
+        #end if
+        return \
+            result
+    #end load
+
+    def save(self, key, pix) :
+        "saves the qahirah.ImageSurface pix in the cache under key, evicting" \
+        " older entries as necessary."
+        pix.flush()
+        filename = self.filename(key)
+        tempname = "%s-%d-%d.tmp" % (filename, os.getpid(), threading.get_ident())
+          # unique to this thread, in case another is saving the same key
+        with open(tempname, "wb") as outfile :
+            outfile.write(self.header.pack(self.magic, self.version, pix.width, pix.height, pix.stride))
+            outfile.write(ct.string_at(pix.data, pix.stride * pix.height))
+        #end with
+        os.replace(tempname, filename)
+        self.evict()
+    #end save
+
+    def evict(self) :
+        "deletes least recently used cache entries until the total size is within" \
+        " max_bytes."
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory) :
+            if entry.name.endswith(".img") :
+                try :
+                    info = entry.stat()
+                except FileNotFoundError :
+                    info = None # another process got there first
+                #end try
+                if info != None :
+                    entries.append((info.st_mtime, info.st_size, entry.path))
+                    total += info.st_size
+                #end if
+            #end if
+        #end for
+        entries.sort()
+        for _, size, path in entries :
+            if total <= self.max_bytes :
+                break
+            #end if
+            try :
+                os.unlink(path)
+            except FileNotFoundError :
+                pass # another process got there first
+            #end try
+            total -= size
+        #end for
+    #end evict
+
+#end ImageCache
+
+def make_image(dimensions, draw, cache = None) :
     "constructs a qahirah.ImageSurface of the specified dimensions, calls draw with a qahirah" \
     " Context to render into it, and returns it. When draw is called, the transformation is" \
-    " set to map (0, 0, 1, 1) to the bounds of the image."
-    pix = qah.ImageSurface.create \
-      (
-        format = CAIRO.FORMAT_ARGB32,
-        dimensions = dimensions
-      )
-    g = qah.Context.create(pix)
-    g.scale(dimensions)
-    g.set_operator(CAIRO.OPERATOR_OVER)
-    draw(g)
-    pix.flush()
+    " set to map (0, 0, 1, 1) to the bounds of the image. If cache is not None, it is an" \
+    " ImageCache in which to look for a previously-made copy of the same image, and in" \
+    " which to save a new one."
+    key = None
+    pix = None
+    if cache != None :
+        key = cache.key(dimensions, draw)
+        if key != None :
+            pix = cache.load(key)
+        #end if
+    #end if
+    if pix == None :
+        pix = qah.ImageSurface.create \
+          (
+            format = CAIRO.FORMAT_ARGB32,
+            dimensions = dimensions
+          )
+        g = qah.Context.create(pix)
+        g.scale(dimensions)
+        g.set_operator(CAIRO.OPERATOR_OVER)
+        draw(g)
+        pix.flush()
+        if key != None :
+            cache.save(key, pix)
+        #end if
+    #end if
     return \
         pix
 #end make_image
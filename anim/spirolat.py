@@ -7,6 +7,7 @@
 #-
 
 import math
+import functools
 from fractions import \
     Fraction
 import qahirah as qah
@@ -15,23 +16,21 @@ from qahirah import \
 from . import \
     common
 
-def draw(g, step, n, angle, reversed, phase, start = 0, end = 1) :
-    "draws a spirolateral curve into the qahirah.Context g. step is the length" \
-    " of a unit step, n is the maximum line length in unit steps, angle is the" \
-    " angle between line segments as a rational Fraction of a circle, reversed" \
-    " is a set of integer line lengths for which to reverse the angle," \
-    " and phase the phase angle for rotating the whole curve."
-
-    if reversed == None :
-        reversed = frozenset()
-    #end if
+@functools.lru_cache(maxsize = 64)
+def segment_geometry(n, angle, reversed) :
+    "returns a tuple (seg_points, seg_rotate, closed) describing a spirolateral" \
+    " curve with a unit step length and zero phase: seg_points is the sequence of" \
+    " Vectors making up one curve segment, centred on the origin, seg_rotate is the" \
+    " Fraction of a circle turned through by one curve segment, and closed indicates" \
+    " whether the curve returns to its starting point. reversed must be a frozenset." \
+    " Results are cached, since these parameters do not usually animate."
     start_point = Vector(0, 0)
     seg_points = []
     point = start_point
     dirn = 0
     for i in range(1, n + 1) :
         seg_points.append(point)
-        point += Vector(i * step, 0).rotate(float(dirn) * qah.circle)
+        point += Vector(i, 0).rotate(float(dirn) * qah.circle)
         dirn += (Fraction(1, 2) - angle) * (1, -1)[i in reversed]
     #end for
     end_point = point
@@ -51,23 +50,39 @@ def draw(g, step, n, angle, reversed, phase, start = 0, end = 1) :
         seg_points.append(point)
     #end if
     origin /= seg_rotate.denominator
-    seg_points = list(point - origin for point in seg_points)
+    seg_points = tuple(point - origin for point in seg_points)
+    return \
+        (seg_points, seg_rotate, closed)
+#end segment_geometry
+
+def draw(g, step, n, angle, reversed, phase, start = 0, end = 1) :
+    "draws a spirolateral curve into the qahirah.Context g. step is the length" \
+    " of a unit step, n is the maximum line length in unit steps, angle is the" \
+    " angle between line segments as a rational Fraction of a circle, reversed" \
+    " is a set of integer line lengths for which to reverse the angle," \
+    " and phase the phase angle for rotating the whole curve."
+
+    if reversed == None :
+        reversed = frozenset()
+    #end if
+    seg_points, seg_rotate, closed = segment_geometry(n, angle, frozenset(reversed))
     nr_steps = seg_rotate.denominator * len(seg_points)
 
-    def curve_func(step) :
+    def curve_func(step_nr) :
         return \
-            seg_points[step % len(seg_points)].rotate \
-              (
-                    float(seg_rotate) * (step // len(seg_points)) * qah.circle
-                +
-                    phase
-              )
+            seg_points[step_nr].rotate(phase) * step
     #end curve_func
 
     common.draw_curve_discrete \
       (
         g = g,
-        f = curve_func,
+        f = common.symmetric_curve_func
+          (
+            f = curve_func,
+            sector_steps = len(seg_points),
+            order = seg_rotate.denominator,
+            angle = float(seg_rotate) * qah.circle
+          ),
         closed = closed,
         nr_steps = nr_steps,
         start = start,
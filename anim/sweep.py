@@ -0,0 +1,207 @@
+#+
+# Rendering of many variants of an animation, differing in their
+# parameter settings, in parallel.
+#
+# Copyright 2026 by Lawrence D'Oliveiro <ldo@geek-central.gen.nz>.
+# Licensed under CC-BY-SA <http://creativecommons.org/licenses/by-sa/4.0/>.
+#-
+
+import os
+import math
+import itertools
+import multiprocessing
+import concurrent.futures
+import qahirah as qah
+from qahirah import \
+    CAIRO, \
+    Rect, \
+    Vector
+from . import \
+    common
+
+def sweep_grid(**params) :
+    "each keyword argument is a sequence of values for the parameter of that name;" \
+    " returns a list of dicts of keyword arguments covering every combination" \
+    " of those values, varying the last parameter fastest."
+    names = tuple(params.keys())
+    return \
+        list \
+          (
+            dict(zip(names, values))
+            for values in itertools.product(*(params[name] for name in names))
+          )
+#end sweep_grid
+
+#+
+# Internal stuff
+#-
+
+sweep_setup = None # worker-process copy of render_sweep arguments
+sweep_draws = {} # worker-process cache of draw procedures, by variant index
+
+def init_sweep_worker(setup) :
+    # runs in each worker process to receive the sweep settings. These are
+    # inherited from the parent on fork rather than pickled, so make_draw_frame
+    # and overall_presetup can be closures or lambdas.
+    global sweep_setup
+    sweep_setup = setup
+#end init_sweep_worker
+
+def variant_draw(index) :
+    # returns the draw procedure for the specified variant, constructing it
+    # only once per worker process.
+    if index not in sweep_draws :
+        sweep_draws[index] = sweep_setup["make_draw_frame"](**sweep_setup["variants"][index])
+    #end if
+    return \
+        sweep_draws[index]
+#end variant_draw
+
+def render_variant(index, out_dir) :
+    # runs in a worker process to render all frames of one variant of the sweep.
+    setup = sweep_setup
+    os.makedirs(out_dir, exist_ok = True)
+    common.render_anim \
+      (
+        dimensions = setup["dimensions"],
+        start_time = setup["start_time"],
+        end_time = setup["end_time"],
+        frame_rate = setup["frame_rate"],
+        draw_frame = variant_draw(index),
+        overall_presetup = setup["overall_presetup"],
+        out_dir = out_dir,
+        start_frame_nr = setup["start_frame_nr"],
+      )
+#end render_variant
+
+def render_sheets(frames, out_dir, sheet_columns) :
+    # runs in a worker process to render all variants for the specified
+    # sequence of (time, frame_nr), tiling them into contact sheets. Each
+    # variant is drawn directly into its own tile of the sheet, through a
+    # Context translated and clipped to that tile, so only the one surface
+    # is needed; each tile keeps the previous frame of its variant, just as
+    # a separate surface would.
+    setup = sweep_setup
+    dimensions = setup["dimensions"]
+    nr_variants = len(setup["variants"])
+    sheet = qah.ImageSurface.create \
+      (
+        CAIRO.FORMAT_ARGB32,
+        Vector(dimensions.x * sheet_columns, dimensions.y * math.ceil(nr_variants / sheet_columns))
+      )
+    tiles = []
+    for i in range(nr_variants) :
+        g = qah.Context.create(sheet)
+        g.translate(Vector(i % sheet_columns * dimensions.x, i // sheet_columns * dimensions.y))
+        g.rectangle(Rect.from_dimensions(dimensions))
+        g.clip()
+        if setup["overall_presetup"] != None :
+            setup["overall_presetup"](g)
+        #end if
+        tiles.append((g, variant_draw(i)))
+    #end for
+    for t, frame_nr in frames :
+        for g, draw_frame in tiles :
+            g.save()
+            draw_frame(g, t)
+            g.restore()
+        #end for
+        sheet.flush()
+        sheet.write_to_png \
+          (
+            os.path.join(out_dir, "{:04d}.png".format(frame_nr))
+          )
+    #end for
+#end render_sheets
+
+#+
+# Mainline
+#-
+
+def render_sweep \
+  (
+    dimensions, # qahirah.Vector, size of each variant
+    start_time,
+    end_time,
+    frame_rate,
+    make_draw_frame, # function returning draw procedure for a variant
+    variants, # sequence of dicts of keyword arguments to make_draw_frame
+    overall_presetup, # called to do once-off setup of qahirah Context
+    out_dir, # where to write output
+    start_frame_nr, # frame number corresponding to time 0
+    nr_workers = None, # number of worker processes, defaults to number of CPUs
+    sheet_columns = None, # if not None, tile variants into contact sheets with this many columns
+  ) :
+    "renders multiple variants of an animation in parallel. Each element of variants" \
+    " is a dict of keyword arguments to pass to make_draw_frame, which returns the draw" \
+    " procedure for that variant; sweep_grid is a convenient way of producing these." \
+    " The remaining arguments have the same meanings as for common.render_anim.\n" \
+    "\n" \
+    "The work is shared out among a pool of nr_workers processes. The worker" \
+    " processes are forked from the caller, so make_draw_frame and overall_presetup" \
+    " need not be picklable, and any setup done before calling render_sweep is" \
+    " inherited rather than repeated. If sheet_columns is None, then each variant is" \
+    " rendered by a single worker, with its PNG frames written to its own subdirectory" \
+    " of out_dir, named with the 3-digit index of the variant. Otherwise, the frames are" \
+    " divided into consecutive ranges, and for each range a worker renders all the" \
+    " variants and tiles them in order into contact sheets, sheet_columns variants" \
+    " wide, which are written as the frames in out_dir. In this case, the draw" \
+    " procedures must not depend on being called for every frame from the start.\n" \
+    "\n" \
+    "Returns the range of frame numbers rendered, as for render_anim."
+    dimensions = Vector.from_tuple(dimensions)
+    variants = tuple(variants)
+    if nr_workers == None :
+        nr_workers = os.cpu_count()
+    #end if
+    frame_times = common.FrameTimeCalc \
+      (
+        start_time = start_time,
+        end_time = end_time,
+        frame_rate = frame_rate,
+        start_frame_nr = start_frame_nr,
+      )
+    to_frame_nr = frame_times.time_to_frame(end_time)
+    setup = \
+        {
+            "dimensions" : dimensions,
+            "start_time" : start_time,
+            "end_time" : end_time,
+            "frame_rate" : frame_rate,
+            "make_draw_frame" : make_draw_frame,
+            "variants" : variants,
+            "overall_presetup" : overall_presetup,
+            "start_frame_nr" : start_frame_nr,
+        }
+    if sheet_columns != None :
+        os.makedirs(out_dir, exist_ok = True)
+        frames = tuple(frame_times.each_frame())
+        chunk_size = max(math.ceil(len(frames) / (nr_workers * 4)), 1)
+          # a few ranges per worker, to even out the load
+        jobs = tuple \
+          (
+            (render_sheets, frames[i : i + chunk_size], out_dir, sheet_columns)
+            for i in range(0, len(frames), chunk_size)
+          )
+    else :
+        jobs = tuple \
+          (
+            (render_variant, i, os.path.join(out_dir, "{:03d}".format(i)))
+            for i in range(len(variants))
+          )
+    #end if
+    with concurrent.futures.ProcessPoolExecutor \
+      (
+        max_workers = nr_workers,
+        mp_context = multiprocessing.get_context("fork"),
+        initializer = init_sweep_worker,
+        initargs = (setup,)
+      ) as workers \
+    :
+        for done in [workers.submit(*job) for job in jobs] :
+            done.result() # reraise any exception in worker
+        #end for
+    #end with
+    return \
+        (start_frame_nr, to_frame_nr)
+#end render_sweep
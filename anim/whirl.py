@@ -13,54 +13,57 @@ import qahirah as qah
 from . import \
     common
 
+def vertices(radius, nr_sides, poly_shrink, nr_polys, phase) :
+    "computes all the vertices of a whirl pattern in one pass, returning a tuple" \
+    " (points, boundaries), where points is the list of nr_polys * nr_sides vertex" \
+    " Vectors, outermost polygon first, and boundaries is the sequence of indices" \
+    " into points at which each polygon starts (plus a final one for the end)." \
+    " Arguments are as for draw."
+    # distance from centre of polygons to centre of one side of outermost polygon =
+    #    radius * math.sin(corner_angle / 2)
+    # therefore, distance from centre of polygons to corner of next-inner polygon =
+    #    radius * step_scale_factor
+    # such that
+    #     step_scale_factor = math.sin(corner_angle / 2) / math.cos(math.pi / nr_sides - abs(step_rotate))
+    # where
+    #     step_rotate = math.pi / nr_sides * poly_shrink
+    step_rotate = math.pi / nr_sides * poly_shrink
+    corner_angle = (0.5 - 1 / nr_sides) * qah.circle
+    step_scale_factor = math.sin(corner_angle / 2) / math.cos(math.pi / nr_sides - abs(step_rotate))
+    side_rotations = tuple \
+      (
+        (math.cos(qah.circle / nr_sides * i), math.sin(qah.circle / nr_sides * i))
+        for i in range(nr_sides)
+      )
+    points = []
+    poly_radius = radius
+    for subcurve_idx in range(nr_polys) :
+        corner = qah.Vector.from_polar(poly_radius, phase + step_rotate * subcurve_idx)
+        for cos, sin in side_rotations :
+            points.append(qah.Vector(corner.x * cos - corner.y * sin, corner.x * sin + corner.y * cos))
+        #end for
+        poly_radius *= step_scale_factor
+    #end for
+    return \
+        (points, range(0, nr_polys * nr_sides + 1, nr_sides))
+#end vertices
+
 def draw(g, radius, nr_sides, poly_shrink, nr_polys, phase, start = 0, end = 1) :
     "draws a whirl pattern into the qahirah.Context g. radius is the radius of" \
     " the outermost polygon, nr_sides is the number of sides per polygon," \
     " poly_shrink is the shrink factor for each successive nested polygon," \
     " in [-1, +1], nr_polys is how many nested polygons to draw, and phase" \
     " is the phase angle for rotating the entire pattern."
-
-    def subcurve_func(step) :
-        return \
-            step // nr_sides
-    #end subcurve_func
-
-    def curve_func(step) :
-        subcurve_idx = step // nr_sides
-        side_idx = step % nr_sides
-        # distance from centre of polygons to centre of one side of outermost polygon =
-        #    radius * math.sin(corner_angle / 2)
-        # therefore, distance from centre of polygons to corner of next-inner polygon =
-        #    radius * step_scale_factor
-        # such that
-        #     step_scale_factor = math.sin(corner_angle / 2) / math.cos(math.pi / nr_sides - abs(step_rotate))
-        # where
-        #     step_rotate = math.pi / nr_sides * poly_shrink
-        step_rotate = math.pi / nr_sides * poly_shrink
-        corner_angle = (0.5 - 1 / nr_sides) * qah.circle
-        step_scale_factor = math.sin(corner_angle / 2) / math.cos(math.pi / nr_sides - abs(step_rotate))
-        scale = step_scale_factor ** subcurve_idx
-        rotate = \
-            (
-                phase
-            +
-                step_rotate * subcurve_idx
-            +
-                qah.circle / nr_sides * side_idx
-            )
-        return \
-            qah.Vector(radius * scale, 0).rotate(rotate)
-    #end curve_func
-
+    points, boundaries = vertices(radius, nr_sides, poly_shrink, nr_polys, phase)
     common.draw_curve_discrete \
       (
         g = g,
-        f = curve_func,
+        f = points.__getitem__,
         closed = True,
-        nr_steps = nr_polys * nr_sides,
+        nr_steps = len(points),
         start = start,
         end = end,
-        subcurve = subcurve_func
+        subcurve = boundaries
       )
 #end draw
 